@@ -0,0 +1,66 @@
+"""
+Синхронный ORM из асинхронных views.
+
+run() выполняет функцию в синхронном потоке запроса, если он есть (WSGI,
+тестовый клиент, async_to_sync): там открыто соединение с базой и идёт
+транзакция, если она есть. Под ASGI такого потока нет, а
+thread_sensitive-функции asgiref 3.2 выполняет в одном потоке на весь
+процесс — то есть по очереди для всех запросов; поэтому там run()
+выполняет функцию в потоке пула со своим соединением.
+
+gather() выполняет несколько независимых функций одновременно, каждую в
+своём потоке со своим соединением; внутри транзакции (в том числе в
+TestCase) чужие соединения не видят её данных, поэтому там функции идут
+по очереди через run().
+
+Обёртки SQL-запросов для всего запроса к сайту (метрики, поиск
+медленных запросов, loadtest) ставятся через yatube.dbwrappers и видны
+во всех этих потоках.
+
+API-эндпоинты остаются синхронными под api_view из DRF: аутентификацию,
+права и CSRF для сессий там проверяет сам DRF.
+"""
+import asyncio
+from functools import partial
+
+from asgiref.sync import AsyncToSync, sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+
+def _request_thread():
+    """Есть ли у запроса свой синхронный поток."""
+    return hasattr(AsyncToSync.executors, 'current')
+
+
+def _in_own_thread(func):
+    def call():
+        try:
+            return func()
+        finally:
+            # Соединения потоков пула живут по правилам CONN_MAX_AGE
+            close_old_connections()
+    return sync_to_async(call, thread_sensitive=False)
+
+
+def run(func, *args, **kwargs):
+    if _request_thread():
+        return sync_to_async(func, thread_sensitive=True)(*args, **kwargs)
+    return _in_own_thread(partial(func, *args, **kwargs))()
+
+
+async def _parallel():
+    if not getattr(settings, 'ASYNC_PARALLEL_QUERIES', True):
+        return False
+    if not _request_thread():
+        # Без потока запроса нет и его транзакции
+        return True
+    return not await run(lambda: connection.in_atomic_block)
+
+
+async def gather(*funcs):
+    """Результаты функций без аргументов в том же порядке."""
+    if len(funcs) > 1 and await _parallel():
+        return await asyncio.gather(*(_in_own_thread(func)()
+                                      for func in funcs))
+    return [await run(func) for func in funcs]
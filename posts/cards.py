@@ -0,0 +1,100 @@
+"""
+Фрагментный кэш карточек постов (includes/post_item.html).
+
+Ключ карточки складывается из id поста, поколений поста, автора и группы
+и количества комментариев. Поколение сдвигается сигналом при
+сохранении объекта, поэтому устаревшие карточки просто перестают
+запрашиваться и вытесняются из кэша сами.
+
+Поколение — время последнего изменения в наносекундах. Кроме объектов
+есть поколения лент (bump_feeds) и общие ('users', 'all') и
+('groups', 'all'); по ним же строятся ETag и Last-Modified страниц
+(posts/conditional.py).
+
+Пока реплика может не знать о последнем сдвиге (yatube/replicas.py),
+собранная из неё карточка не кэшируется: иначе старые данные легли бы
+в кэш под новым поколением.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from yatube import replicas
+
+TEMPLATE = 'includes/post_item.html'
+
+
+def _generation_key(kind, pk):
+    return f'card-gen:{kind}:{pk}'
+
+
+def bump(kind, pk):
+    """Сбрасывает карточки, зависящие от объекта kind с первичным ключом pk."""
+    cache.set(_generation_key(kind, pk), time.time_ns(), None)
+
+
+def bump_feeds(author_id, group_id):
+    """Сдвигает поколения лент, в которых виден пост автора и группы."""
+    bump('feed', 'all')
+    bump('author-feed', author_id)
+    if group_id is not None:
+        bump('group-feed', group_id)
+
+
+def _generations(keys):
+    # Вытесненное из кэша поколение начинается заново с текущего времени,
+    # чтобы не совпасть со старыми ключами карточек
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            cache.add(key, time.time_ns(), None)
+            generations[key] = cache.get(key)
+    return generations
+
+
+def generations(*objects):
+    """Поколения объектов, заданных парами (kind, pk), в том же порядке."""
+    keys = [_generation_key(kind, pk) for kind, pk in objects]
+    found = _generations(keys)
+    return [found[key] for key in keys]
+
+
+def settled(generations):
+    """Прочитанные сейчас данные соответствуют поколениям generations."""
+    return not replicas.lagging(max(generations))
+
+
+def _card_generations(post):
+    keys = [
+        _generation_key('post', post.pk),
+        _generation_key('user', post.author_id),
+        _generation_key('group', post.group_id),
+    ]
+    generations = _generations(keys)
+    return [generations[key] for key in keys]
+
+
+def _card_key(post, is_owner, generations):
+    versions = '.'.join(str(generation) for generation in generations)
+    return (f'post-card:{post.pk}:{versions}:{post.comment_count}:'
+            f'{int(is_owner)}')
+
+
+def card_key(post, is_owner):
+    return _card_key(post, is_owner, _card_generations(post))
+
+
+def render_card(post, user):
+    is_owner = user is not None and user == post.author
+    generations = _card_generations(post)
+    key = _card_key(post, is_owner, generations)
+    html = cache.get(key)
+    if html is None:
+        html = render_to_string(TEMPLATE, {'post': post, 'user': user})
+        if settled(generations):
+            timeout = getattr(settings, 'POST_CARD_CACHE_TIMEOUT',
+                              60 * 60 * 24)
+            cache.set(key, html, timeout)
+    return html
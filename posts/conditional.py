@@ -0,0 +1,183 @@
+"""
+Валидаторы для условных GET-запросов (ETag / Last-Modified).
+
+Состояние страницы описывают поколения из кэша карточек (posts/cards.py)
+— поста, автора, группы и лент, в которые они попадают, — и счётчики
+UserStats, так что проверка не читает посты из базы. Поколение — время
+последнего изменения, самое позднее идёт в Last-Modified. Страницы
+зависят от того, кто их смотрит, поэтому в ETag входит id пользователя,
+а Last-Modified отдаётся только анонимам. Пока реплика может отставать
+от последнего изменения, валидаторов нет вовсе.
+
+Объекты, без которых состояние не описать (профиль со счётчиками,
+группа, пост), загружаются один раз за запрос: view берёт их отсюда же.
+"""
+import asyncio
+import hashlib
+from datetime import datetime, timezone
+from functools import wraps
+
+from django.contrib.auth import get_user_model
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import condition
+
+from . import aio, cards, follows, ingest
+from .feeds import post_cards
+from .models import Group, Post
+from .stats import get_stats
+
+User = get_user_model()
+
+
+def _validators(request, generations, extra=()):
+    user = getattr(request, 'user', None)
+    viewer = user.pk if user is not None and user.is_authenticated else 0
+    if not cards.settled(generations):
+        # Страница может собраться из реплики, ещё не получившей
+        # изменение: с ETag нового поколения её старое содержимое потом
+        # подтверждалось бы ответом 304
+        return None, None, viewer
+    parts = [*generations, viewer, *extra]
+    etag = hashlib.md5(
+        '|'.join(str(part) for part in parts).encode()
+    ).hexdigest()
+    latest = datetime.fromtimestamp(max(generations) / 10 ** 9, timezone.utc)
+    return etag, latest, viewer
+
+
+def feed_condition(get_state):
+    """
+    Декоратор в духе django.views.decorators.http.condition: get_state
+    получает request и аргументы view и возвращает пару — поколения
+    (cards.generations) и ещё что-то, от чего зависит страница.
+    """
+    def validators(request, *args, **kwargs):
+        # condition() спрашивает ETag и Last-Modified по отдельности
+        cached = getattr(request, '_conditional_validators', None)
+        if cached is None:
+            cached = request._conditional_validators = _validators(
+                request, *get_state(request, *args, **kwargs)
+            )
+        return cached
+
+    def etag(request, *args, **kwargs):
+        return validators(request, *args, **kwargs)[0]
+
+    def last_modified(request, *args, **kwargs):
+        _, latest, viewer = validators(request, *args, **kwargs)
+        return None if viewer else latest
+
+    check = condition(etag_func=etag, last_modified_func=last_modified)
+
+    def decorator(view):
+        if not asyncio.iscoroutinefunction(view):
+            return check(view)
+
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            # Проверка condition() в потоке запроса: либо готовый
+            # 304/412, либо заглушка с заголовками для настоящего ответа
+            passed = []
+
+            def proceed(request, *args, **kwargs):
+                passed.append(True)
+                return HttpResponse()
+
+            checked = await aio.run(check(proceed), request, *args, **kwargs)
+            if not passed:
+                return checked
+            response = await view(request, *args, **kwargs)
+            for header in ('ETag', 'Last-Modified'):
+                if checked.has_header(header):
+                    response.setdefault(header, checked[header])
+            return response
+        return inner
+    return decorator
+
+
+def _loaded(request, key, load):
+    loaded = request.__dict__.setdefault('_page_objects', {})
+    if key not in loaded:
+        loaded[key] = load()
+    return loaded[key]
+
+
+def profile_owner(request, username):
+    """Владелец профиля и его счётчики (UserStats); нет такого — 404."""
+    def load():
+        profile = get_object_or_404(User, username=username)
+        return profile, get_stats(profile)
+    return _loaded(request, ('profile', username), load)
+
+
+def page_group(request, slug):
+    return _loaded(request, ('group', slug),
+                   lambda: get_object_or_404(Group, slug=slug))
+
+
+def page_post(request, username, post_id):
+    """Пост страницы с автором и группой — одним запросом."""
+    return _loaded(request, ('post', post_id), lambda: get_object_or_404(
+        post_cards(Post.objects), id=post_id, author__username=username
+    ))
+
+
+def api_post(request, post_id):
+    return _loaded(request, ('api-post', post_id),
+                   lambda: get_object_or_404(Post, id=post_id))
+
+
+def comments_post(request, username, post_id):
+    """Только id поста: комментариям нужно лишь убедиться, что он есть."""
+    return _loaded(request, ('comments-post', post_id), lambda:
+                   get_object_or_404(Post.objects.only('id'), id=post_id,
+                                     author__username=username))
+
+
+def all_posts(request, *args, **kwargs):
+    return cards.generations(('feed', 'all'), ('users', 'all'),
+                             ('groups', 'all')), ()
+
+
+def group_posts(request, slug):
+    group = page_group(request, slug)
+    return cards.generations(('group-feed', group.pk), ('group', group.pk),
+                             ('users', 'all')), ()
+
+
+def author_posts(request, username):
+    """Лента автора, карточка профиля со счётчиками и кнопкой подписки."""
+    profile, stats = profile_owner(request, username)
+    generations = cards.generations(('author-feed', profile.pk),
+                                    ('user', profile.pk), ('groups', 'all'))
+    return generations, (stats.posts_count, stats.followers_count,
+                         stats.following_count, follows.version(request.user))
+
+
+def post_page(request, username, post_id):
+    """
+    Пост с комментариями и блоком «Ещё от автора», подписки зрителя
+    (кнопка в карточке профиля) и его комментарии, ещё не записанные из
+    журнала (posts/ingest.py).
+    """
+    post = page_post(request, username, post_id)
+    generations = cards.generations(
+        ('post', post.pk), ('user', post.author_id),
+        ('group', post.group_id), ('author-feed', post.author_id),
+    )
+    pending = [item['key'] for item in ingest.pending(request, post.pk)]
+    return generations, [follows.version(request.user), *pending]
+
+
+def single_post(request, post_id):
+    # Поколения читаются только для существующего поста: иначе каждый
+    # запрос к несуществующему оставлял бы в кэше вечную запись
+    post = api_post(request, post_id)
+    return cards.generations(('post', post.pk)), ()
+
+
+def post_comments(request, username, post_id):
+    post = comments_post(request, username, post_id)
+    # В комментариях видны имена их авторов
+    return cards.generations(('post', post.pk), ('users', 'all')), ()
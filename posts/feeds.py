@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Post
+from .paginators import FEED_ORDERING
+
+
+def post_cards(queryset):
+    """
+    Готовит queryset постов к выводу карточками includes/post_item.html:
+    автор и группа подтягиваются JOIN-ом, количество комментариев хранится
+    в самом посте (Post.comment_count), так что страница ленты не делает
+    дополнительных запросов на каждый пост.
+    """
+    return queryset.select_related('author', 'group')
+
+
+def _window_key(author_id):
+    return f'author-window:{author_id}'
+
+
+def author_strip(post):
+    """
+    Блок «Ещё от автора» на странице поста: до AUTHOR_STRIP_SIZE других
+    последних постов автора (строки values() с id, text, pub_date) из
+    небольшого окна в кэше вместо пагинатора по всей ленте.
+    """
+    size = getattr(settings, 'AUTHOR_STRIP_SIZE', 5)
+    if not size:
+        return []
+    # В окне на строку больше: одной из них может быть сам пост
+    window = _author_window(post.author_id, size + 1)
+    return [row for row in window if row['id'] != post.pk][:size]
+
+
+def _author_window(author_id, size):
+    def load():
+        posts = Post.objects.filter(author_id=author_id)
+        return list(posts.order_by(*FEED_ORDERING)
+                    .values('id', 'text', 'pub_date')[:size])
+    timeout = getattr(settings, 'AUTHOR_STRIP_CACHE_TIMEOUT', 60 * 10)
+    return cache.get_or_set(_window_key(author_id), load, timeout)
+
+
+def forget_author_window(author_id):
+    cache.delete(_window_key(author_id))
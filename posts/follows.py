@@ -0,0 +1,147 @@
+"""
+Граф подписок: пакетная подписка и отписка и кэш смежности в памяти.
+
+following(user_id) — множество id авторов, на которых подписан
+пользователь, из словаря процесса (последние FOLLOW_GRAPH_CACHE_SIZE
+пользователей). Актуальность сверяется с поколением в общем кэше —
+без запроса к базе; поколение сдвигается после коммита любой подписки
+или отписки пользователя, в том числе в других процессах. Подписки
+читаются из основной базы, а не из реплики.
+
+follow_many и unfollow_many меняют подписки одной транзакцией:
+bulk_create(ignore_conflicts=True) опирается на уникальность
+(author, user) и не посылает сигналов, поэтому счётчики профиля
+(пересчётом по Follow), лента подписок и кэш обновляются здесь явно.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from . import stats, timeline
+from .models import Follow
+
+_adjacency = OrderedDict()
+_lock = threading.Lock()
+
+
+def _generation_key(user_id):
+    return f'follow-gen:{user_id}'
+
+
+def _generation(user_id):
+    key = _generation_key(user_id)
+    generation = cache.get(key)
+    if generation is None:
+        # Как у карточек: вытесненное поколение начинается с текущего
+        # времени и не совпадёт со старым
+        cache.add(key, time.time_ns(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def following(user_id):
+    """frozenset id авторов, на которых подписан пользователь."""
+    generation = _generation(user_id)
+    with _lock:
+        cached = _adjacency.get(user_id)
+        if cached is not None and cached[0] == generation:
+            _adjacency.move_to_end(user_id)
+            return cached[1]
+    # Из основной базы: реплика может ещё не знать подписку, из-за
+    # которой сдвинулось поколение
+    authors = frozenset(Follow.objects.using(DEFAULT_DB_ALIAS)
+                        .filter(user_id=user_id)
+                        .values_list('author_id', flat=True))
+    size = getattr(settings, 'FOLLOW_GRAPH_CACHE_SIZE', 10000)
+    with _lock:
+        _adjacency[user_id] = (generation, authors)
+        _adjacency.move_to_end(user_id)
+        while len(_adjacency) > size:
+            _adjacency.popitem(last=False)
+    return authors
+
+
+def is_following(user, author):
+    """Подписан ли user на author; аноним ни на кого не подписан."""
+    if user is None or not user.is_authenticated:
+        return False
+    return getattr(author, 'pk', author) in following(user.pk)
+
+
+def version(user):
+    """Меняется при каждом изменении подписок user; для ETag страниц."""
+    if user is None or not user.is_authenticated:
+        return None
+    return _generation(user.pk)
+
+
+def _forget(user_id):
+    with _lock:
+        _adjacency.pop(user_id, None)
+    key = _generation_key(user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def invalidate(user_id):
+    """
+    Сбрасывает подписки пользователя в кэше сейчас и ещё раз после
+    коммита: иначе другой поток успел бы закэшировать старые подписки
+    под новым поколением.
+    """
+    _forget(user_id)
+    transaction.on_commit(lambda: _forget(user_id))
+
+
+def follow_many(user, authors):
+    """
+    Подписывает user на пользователей authors (queryset или список).
+    Возвращает id авторов, подписка на которых появилась сейчас.
+    """
+    with transaction.atomic():
+        author_ids = {author.pk for author in authors} - {user.pk}
+        author_ids -= set(Follow.objects.filter(
+            user=user, author_id__in=author_ids
+        ).values_list('author_id', flat=True))
+        if not author_ids:
+            return []
+        Follow.objects.bulk_create(
+            [Follow(user=user, author_id=author_id)
+             for author_id in author_ids],
+            ignore_conflicts=True,
+        )
+        # Сигналы follow_created при bulk_create не срабатывают, а часть
+        # строк могла вставить одновременная подписка: счётчики
+        # пересчитываются по Follow, а не сдвигаются на len(author_ids)
+        stats.recount(author_ids, 'followers_count')
+        stats.recount([user.pk], 'following_count')
+        for author_id in author_ids:
+            timeline.backfill(user, author_id)
+        invalidate(user.pk)
+    return sorted(author_ids)
+
+
+def unfollow_many(user, authors):
+    """
+    Отписывает user от authors. Возвращает id авторов, от которых
+    пользователь действительно был отписан.
+    """
+    with transaction.atomic():
+        subscriptions = Follow.objects.filter(
+            user=user, author_id__in=[author.pk for author in authors]
+        )
+        author_ids = sorted(subscriptions.values_list('author_id',
+                                                      flat=True))
+        if not author_ids:
+            return []
+        # QuerySet.delete посылает post_delete: счётчики и кэш
+        # обновят сигналы
+        subscriptions.delete()
+        for author_id in author_ids:
+            timeline.prune(user, author_id)
+    return author_ids
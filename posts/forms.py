@@ -1,7 +1,9 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
 from django.forms import ModelForm
 from django.utils.translation import gettext_lazy as _
 
+from .images import process_upload
 from .models import Post, Comment
 
 
@@ -17,6 +19,12 @@ class PostForm(ModelForm):
             'image': _('Картинка'),
         }
 
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        if isinstance(image, UploadedFile):
+            return process_upload(image)
+        return image
+
 class CommentForm(ModelForm):
 
     class Meta:
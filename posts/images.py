@@ -0,0 +1,57 @@
+"""
+Подготовка загруженной картинки поста к хранению.
+
+Размеры берутся из заголовка файла без декодирования изображения.
+JPEG декодируется сразу в уменьшенном масштабе (draft), остальное
+уменьшается через reduce внутри thumbnail. Метаданные (EXIF, ICC)
+не переносятся, результат пишется компактным JPEG или PNG, если
+у картинки есть прозрачность.
+"""
+import os
+from io import BytesIO
+
+from PIL import Image, ImageOps
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+
+
+def _has_alpha(image):
+    return (image.mode in ('RGBA', 'LA')
+            or (image.mode == 'P' and 'transparency' in image.info))
+
+
+def process_upload(upload):
+    max_bytes = getattr(settings, 'POST_IMAGE_MAX_UPLOAD_SIZE',
+                        10 * 1024 * 1024)
+    max_pixels = getattr(settings, 'POST_IMAGE_MAX_PIXELS', 40000000)
+    max_side = getattr(settings, 'POST_IMAGE_MAX_SIDE', 1920)
+    if upload.size > max_bytes:
+        raise ValidationError(
+            'Файл слишком большой: не больше %(size)s МБ.',
+            code='file_too_large',
+            params={'size': max_bytes // (1024 * 1024)},
+        )
+    upload.seek(0)
+    image = Image.open(upload)
+    width, height = image.size
+    if width * height > max_pixels:
+        raise ValidationError(
+            'Картинка слишком большая: %(width)s×%(height)s пикселей.',
+            code='too_many_pixels',
+            params={'width': width, 'height': height},
+        )
+    image.draft('RGB', (max_side, max_side))
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((max_side, max_side), reducing_gap=2.0)
+
+    output = BytesIO()
+    if _has_alpha(image):
+        image.convert('RGBA').save(output, 'PNG', optimize=True)
+        extension = 'png'
+    else:
+        image.convert('RGB').save(output, 'JPEG', quality=85,
+                                  optimize=True, progressive=True)
+        extension = 'jpg'
+    name = os.path.splitext(os.path.basename(upload.name))[0]
+    return ContentFile(output.getvalue(), name=f'{name}.{extension}')
@@ -0,0 +1,275 @@
+"""
+Отложенная запись комментариев (write-behind) для горячих постов.
+
+С настройкой COMMENT_WRITE_BEHIND add_comment не пишет в базу: проверенный
+формой комментарий дописывается строкой JSON в журнал процесса
+(COMMENT_JOURNAL_DIR/<pid>.jsonl, с fsync), а фоновый поток раз в
+COMMENT_FLUSH_INTERVAL секунд переименовывает журнал в пачку *.batch и
+записывает её одной транзакцией через bulk_create. Так сотни
+комментаторов одного поста берут блокировку записи SQLite раз в
+интервал, а не каждый.
+
+bulk_create не посылает сигналов, поэтому счётчик Post.comment_count,
+поисковый индекс и поколения карточек обновляются здесь же. Имя пачки
+сохраняется в CommentBatch в той же транзакции: пачка, пережившая сбой
+между коммитом и удалением файла, не запишется дважды. Журналы умерших
+процессов подбираются при следующем сбросе, manage.py flush_comments
+сбрасывает всё сразу.
+
+Пока комментарий в журнале, автор видит его на странице поста: он
+запоминается в сессии на COMMENT_PENDING_SECONDS секунд.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.db import (IntegrityError, close_old_connections, connection,
+                       transaction)
+from django.db.models import F, Max
+from django.utils import timezone
+
+from . import cards, search
+from .models import Comment, CommentBatch, Post, User
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = 'pending_comments'
+# Сколько неподтверждённых комментариев помнить в сессии
+PENDING_LIMIT = 20
+
+_lock = threading.Lock()
+_worker = None
+
+
+def enabled():
+    return getattr(settings, 'COMMENT_WRITE_BEHIND', False)
+
+
+def journal_dir():
+    return getattr(settings, 'COMMENT_JOURNAL_DIR',
+                   os.path.join(settings.BASE_DIR, 'var', 'comments'))
+
+
+def _journal_path(pid=None):
+    return os.path.join(journal_dir(), f'{pid or os.getpid()}.jsonl')
+
+
+def submit(request, post, text):
+    """Ставит комментарий request.user к post в журнал."""
+    entry = {'key': uuid.uuid4().hex, 'post': post.pk,
+             'author': request.user.pk, 'text': text}
+    line = json.dumps(entry, ensure_ascii=False) + '\n'
+    os.makedirs(journal_dir(), exist_ok=True)
+    with _lock:
+        with open(_journal_path(), 'a', encoding='utf-8') as journal:
+            journal.write(line)
+            journal.flush()
+            os.fsync(journal.fileno())
+    _remember(request, entry)
+    _ensure_worker()
+    return entry
+
+
+def _remember(request, entry):
+    pending = [item for item in request.session.get(PENDING_KEY, [])
+               if _fresh(item)]
+    pending.append({'key': entry['key'], 'post': entry['post'],
+                    'text': entry['text'], 'at': time.time()})
+    request.session[PENDING_KEY] = pending[-PENDING_LIMIT:]
+
+
+def _fresh(item):
+    ttl = getattr(settings, 'COMMENT_PENDING_SECONDS', 30)
+    return time.time() - item['at'] < ttl
+
+
+def pending(request, post_id):
+    """
+    Свои комментарии пользователя к посту, которые, возможно, ещё лежат
+    в журнале: словари с ключами key и text, новые первыми.
+    """
+    if not enabled() or not request.user.is_authenticated:
+        return []
+    items = request.session.get(PENDING_KEY, [])
+    return [item for item in reversed(items)
+            if item['post'] == post_id and _fresh(item)]
+
+
+def unconfirmed(request, post_id, comments):
+    """
+    pending() без тех, что уже видны среди comments — сброшенных в базу
+    комментариев этого же пользователя.
+    """
+    saved = {comment.text for comment in comments
+             if comment.author_id == request.user.pk}
+    return [item for item in pending(request, post_id)
+            if item['text'] not in saved]
+
+
+def _rotate(path):
+    """Переименовывает журнал в пачку; None, если журнал пуст."""
+    try:
+        if os.path.getsize(path) == 0:
+            return None
+    except FileNotFoundError:
+        return None
+    name = os.path.basename(path)[:-len('.jsonl')]
+    batch = os.path.join(journal_dir(), f'{name}-{time.time_ns()}.batch')
+    os.rename(path, batch)
+    return batch
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _orphans():
+    """Журналы процессов, которых больше нет."""
+    for name in os.listdir(journal_dir()):
+        if not name.endswith('.jsonl'):
+            continue
+        pid = name[:-len('.jsonl')]
+        if pid.isdigit() and int(pid) != os.getpid() and not _alive(int(pid)):
+            yield os.path.join(journal_dir(), name)
+
+
+def flush(everything=False):
+    """
+    Записывает в базу журнал этого процесса, журналы умерших процессов
+    и оставшиеся пачки; everything — журналы всех процессов (для
+    manage.py flush_comments, когда сайт остановлен). Возвращает
+    количество записанных комментариев.
+    """
+    if not os.path.isdir(journal_dir()):
+        return 0
+    with _lock:
+        _rotate(_journal_path())
+    journals = (
+        [os.path.join(journal_dir(), name)
+         for name in os.listdir(journal_dir()) if name.endswith('.jsonl')]
+        if everything else list(_orphans())
+    )
+    for path in journals:
+        _rotate(path)
+    saved = 0
+    for name in sorted(os.listdir(journal_dir())):
+        if name.endswith('.batch'):
+            saved += _flush_batch(os.path.join(journal_dir(), name))
+    return saved
+
+
+def _read(path):
+    entries = []
+    with open(path, encoding='utf-8') as batch:
+        for number, line in enumerate(batch, 1):
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # Недописанная при сбое строка
+                logger.error('%s:%s: испорченная запись журнала',
+                             path, number)
+    return entries
+
+
+def _flush_batch(path):
+    name = os.path.basename(path)
+    try:
+        entries = _read(path)
+    except FileNotFoundError:
+        # Пачку уже записал другой процесс
+        return 0
+    try:
+        with transaction.atomic():
+            # Запись до любого чтения: транзакция сразу берёт блокировку
+            # записи SQLite и не упирается в устаревший снимок
+            CommentBatch.objects.create(name=name)
+            saved = len(_save(entries))
+    except IntegrityError:
+        # Пачка уже записана: процесс упал до удаления файла
+        saved = 0
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    return saved
+
+
+def _save(entries):
+    owners = {
+        pk: (author_id, group_id)
+        for pk, author_id, group_id in Post.objects.filter(
+            pk__in={entry['post'] for entry in entries}
+        ).values_list('pk', 'author_id', 'group_id')
+    }
+    author_ids = set(User.objects.filter(
+        pk__in={entry['author'] for entry in entries}
+    ).values_list('pk', flat=True))
+    # Пост или автор могли быть удалены, пока комментарий ждал в журнале
+    comments = [
+        Comment(post_id=entry['post'], author_id=entry['author'],
+                text=entry['text'])
+        for entry in entries
+        if entry['post'] in owners and entry['author'] in author_ids
+    ]
+    if not comments:
+        return comments
+    if not connection.features.can_return_rows_from_bulk_insert:
+        # SQLite не возвращает id из bulk_create, а они нужны поиску.
+        # Блокировка записи уже у этой транзакции, так что между MAX(id)
+        # и вставкой никто другой комментарий не добавит
+        top = Comment.objects.aggregate(top=Max('id'))['top'] or 0
+        for number, comment in enumerate(comments, top + 1):
+            comment.id = number
+    Comment.objects.bulk_create(comments, batch_size=500)
+    # То, что для одиночного комментария делают сигналы
+    counts = Counter(comment.post_id for comment in comments)
+    now = timezone.now()
+    for post_id, count in counts.items():
+        Post.objects.filter(pk=post_id).update(
+            comment_count=F('comment_count') + count, updated=now
+        )
+    search.get_index().add_many(
+        [(search.COMMENT, comment.pk, comment.post_id, comment.text)
+         for comment in comments]
+    )
+
+    def bump_cards():
+        for post_id in counts:
+            cards.bump('post', post_id)
+            cards.bump_feeds(*owners[post_id])
+    transaction.on_commit(bump_cards)
+    return comments
+
+
+def _run():
+    while True:
+        time.sleep(getattr(settings, 'COMMENT_FLUSH_INTERVAL', 1))
+        try:
+            flush()
+        except Exception:
+            # Журнал остаётся на диске до следующей попытки
+            logger.exception('Не удалось записать комментарии из журнала')
+        finally:
+            close_old_connections()
+
+
+def _ensure_worker():
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    with _lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name='comment-flush',
+                                       daemon=True)
+            _worker.start()
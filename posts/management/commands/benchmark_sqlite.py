@@ -0,0 +1,139 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from yatube.sqlite3.base import DEFAULT_PRAGMAS, apply_pragmas
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает конкурентные чтения и записи в SQLite с настройками '
+        'по умолчанию и с PRAGMA из yatube/sqlite3 на временной базе'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--rows', type=int, default=50000)
+
+    def handle(self, *args, **options):
+        tuned = {**DEFAULT_PRAGMAS,
+                 **settings.DATABASES['default'].get('PRAGMAS', {})}
+        modes = (
+            ('по умолчанию', {}),
+            ('WAL + PRAGMA', tuned),
+        )
+        self.stdout.write(
+            f"{'Режим':<14}{'чтений/с':>10}{'записей/с':>11}"
+            f"{'p95 чтения, мс':>16}{'ошибок':>8}"
+        )
+        for title, pragmas in modes:
+            result = self.run_mode(pragmas, options)
+            self.stdout.write(
+                f"{title:<14}{result['reads']:>10.0f}{result['writes']:>11.0f}"
+                f"{result['read_p95_ms']:>16.2f}{result['errors']:>8}"
+            )
+
+    def prepare(self, path, pragmas, rows):
+        connection = sqlite3.connect(path)
+        apply_pragmas(connection, pragmas)
+        connection.execute(
+            'CREATE TABLE post (id INTEGER PRIMARY KEY, text TEXT, '
+            'pub_date REAL)'
+        )
+        connection.execute('CREATE INDEX post_pub_date ON post (pub_date)')
+        connection.executemany(
+            'INSERT INTO post (text, pub_date) VALUES (?, ?)',
+            ((f'Пост {i} ' * 10, i) for i in range(rows)),
+        )
+        connection.commit()
+        connection.close()
+
+    def run_mode(self, pragmas, options):
+        directory = tempfile.mkdtemp(prefix='sqlite-benchmark-')
+        path = os.path.join(directory, 'bench.sqlite3')
+        self.prepare(path, pragmas, options['rows'])
+        deadline = time.monotonic() + options['seconds']
+        lock = threading.Lock()
+        totals = {'reads': 0, 'writes': 0, 'errors': 0}
+        latencies = []
+
+        def connect():
+            # Как у Django: таймаут ожидания блокировки по умолчанию 5 с
+            connection = sqlite3.connect(path, timeout=5)
+            apply_pragmas(connection, pragmas)
+            return connection
+
+        def reader():
+            connection = connect()
+            rnd = random.Random()
+            reads, errors, own = 0, 0, []
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    connection.execute(
+                        'SELECT id, text FROM post ORDER BY pub_date DESC '
+                        'LIMIT 10 OFFSET ?', (rnd.randrange(1000),)
+                    ).fetchall()
+                    reads += 1
+                    own.append(time.perf_counter() - started)
+                except sqlite3.OperationalError:
+                    errors += 1
+            connection.close()
+            with lock:
+                totals['reads'] += reads
+                totals['errors'] += errors
+                latencies.extend(own)
+
+        def writer():
+            connection = connect()
+            writes, errors = 0, 0
+            while time.monotonic() < deadline:
+                try:
+                    with connection:
+                        connection.execute(
+                            'INSERT INTO post (text, pub_date) VALUES (?, ?)',
+                            ('Новый пост', time.time()),
+                        )
+                    writes += 1
+                except sqlite3.OperationalError:
+                    errors += 1
+            connection.close()
+            with lock:
+                totals['writes'] += writes
+                totals['errors'] += errors
+
+        threads = (
+            [threading.Thread(target=reader)
+             for _ in range(options['readers'])]
+            + [threading.Thread(target=writer)
+               for _ in range(options['writers'])]
+        )
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+        seconds = options['seconds']
+        return {
+            'reads': totals['reads'] / seconds,
+            'writes': totals['writes'] / seconds,
+            'read_p95_ms': percentile(latencies, 0.95) * 1000,
+            'errors': totals['errors'],
+        }
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from posts import ingest
+
+
+class Command(BaseCommand):
+    help = (
+        'Записывает в базу комментарии из журналов отложенной записи; '
+        'с --all — и журналы работающих процессов (запускать, когда сайт '
+        'остановлен)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', dest='everything')
+
+    def handle(self, *args, **options):
+        saved = ingest.flush(everything=options['everything'])
+        self.stdout.write(f'Записано комментариев: {saved}')
@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import synthetic
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу синтетическими пользователями, подписками, постами '
+        'и комментариями с реалистичной асимметрией: степенной закон '
+        'подписчиков, публикации всплесками. Всё в одной транзакции.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--posts', type=int, default=1000000)
+        parser.add_argument('--follows', type=int, default=200000)
+        parser.add_argument('--comments', type=int, default=2000000)
+        parser.add_argument('--days', type=int, default=365,
+                            help='За сколько дней распределить посты')
+        parser.add_argument('--prefix', default='synthetic',
+                            help='Префикс имён пользователей и групп')
+        parser.add_argument('--batch-size', type=int,
+                            default=synthetic.BATCH_SIZE)
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Зерно генератора случайных чисел')
+        parser.add_argument('--skip-derived', action='store_true',
+                            help='Не пересчитывать счётчики, поисковый '
+                                 'индекс и ленты')
+
+    def handle(self, *args, **options):
+        self.started = time.monotonic()
+        generator = synthetic.Generator(
+            users=options['users'],
+            posts=options['posts'],
+            follows=options['follows'],
+            comments=options['comments'],
+            days=options['days'],
+            prefix=options['prefix'],
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+            progress=self.report,
+        )
+        with transaction.atomic():
+            generator.run()
+            if not options['skip_derived']:
+                self.stdout.write('Пересчёт производных данных...')
+                synthetic.derive()
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {time.monotonic() - self.started:.1f} с'
+        ))
+
+    def report(self, label, done, total):
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(f'{label}: {done}/{total} ({elapsed:.1f} с)')
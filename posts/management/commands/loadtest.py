@@ -0,0 +1,279 @@
+import copy
+import json
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+from importlib import import_module
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.contrib.auth import (BACKEND_SESSION_KEY, HASH_SESSION_KEY,
+                                 SESSION_KEY, get_user_model)
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (override_settings, setup_databases,
+                               teardown_databases)
+from django.urls import resolve, reverse
+from django.utils.module_loading import import_string
+from rest_framework.authtoken.models import Token
+
+from posts import synthetic
+from posts.models import Group, Post
+from yatube import dbwrappers
+
+User = get_user_model()
+
+# Смесь запросов по умолчанию: имя URL -> вес
+DEFAULT_MIX = {
+    'index': 40,
+    'group': 10,
+    'profile': 15,
+    'post': 20,
+    'follow_index': 10,
+    'get_posts': 5,
+}
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(share * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест: заполняет базу синтетическими данными и '
+        'прогоняет смесь запросов через WSGI-приложение в этом же процессе. '
+        'Отчёт по каждому имени URL: p50/p95/p99, запросы к БД, RPS.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--posts', type=int, default=1000)
+        parser.add_argument('--follows', type=int, default=500)
+        parser.add_argument('--comments', type=int, default=2000)
+        parser.add_argument('--requests', type=int, default=1000,
+                            help='Сколько запросов сгенерировать')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--replay', metavar='FILE',
+                            help='JSONL с записанными запросами: '
+                                 '{"method", "path", "user", "data"}')
+        parser.add_argument('--output', default='loadtest.json',
+                            help='Куда записать отчёт в JSON')
+        parser.add_argument('--existing-db', action='store_true',
+                            help='Работать с настроенной базой, а не '
+                                 'с временной тестовой')
+        parser.add_argument('--no-seed', action='store_true')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Зерно генератора случайных чисел')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        old_config = None
+        with ExitStack() as stack:
+            if not options['existing_db']:
+                stack.enter_context(self.isolated_cache())
+                old_config = setup_databases(verbosity=0, interactive=False)
+            try:
+                report = self.benchmark(options)
+            finally:
+                if old_config is not None:
+                    teardown_databases(old_config, verbosity=0)
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2, ensure_ascii=False,
+                      sort_keys=True)
+        self.print_report(report)
+
+    def isolated_cache(self):
+        """Кэш того же типа, но в отдельном месте — не смешивать с боевым."""
+        directory = tempfile.mkdtemp(prefix='loadtest-cache-')
+        caches = copy.deepcopy(settings.CACHES)
+        for alias, config in caches.items():
+            config['LOCATION'] = os.path.join(directory, f'{alias}.sqlite3')
+        return override_settings(CACHES=caches)
+
+    def benchmark(self, options):
+        if not options['no_seed']:
+            self.seed(options)
+        if options['replay']:
+            plan = self.load_plan(options['replay'])
+        else:
+            plan = self.generate_plan(options['requests'])
+        if not plan:
+            raise CommandError('Нет запросов для прогона')
+        return self.run(plan, options['concurrency'])
+
+    def seed(self, options):
+        synthetic.Generator(
+            users=options['users'],
+            posts=options['posts'],
+            follows=options['follows'],
+            comments=options['comments'],
+            prefix='load',
+            seed=options['seed'],
+        ).run()
+        synthetic.derive()
+
+    def generate_plan(self, count):
+        rnd = self.random
+        users = list(User.objects.values_list('username', flat=True))
+        groups = list(Group.objects.values_list('slug', flat=True))
+        posts = list(Post.objects.values_list('pk', 'author__username'))
+        if not users or not posts:
+            raise CommandError('В базе нет данных, уберите --no-seed')
+        names, weights = zip(*DEFAULT_MIX.items())
+        plan = []
+        for name in rnd.choices(names, weights, k=count):
+            user = None
+            if name == 'index':
+                path = reverse('index')
+            elif name == 'group' and groups:
+                path = reverse('group', args=[rnd.choice(groups)])
+            elif name == 'profile':
+                path = reverse('profile', args=[rnd.choice(users)])
+            elif name == 'follow_index':
+                path, user = reverse('follow_index'), rnd.choice(users)
+            elif name == 'get_posts':
+                path, user = reverse('get_posts'), rnd.choice(users)
+            else:
+                post_id, author = rnd.choice(posts)
+                path = reverse('post', args=[author, post_id])
+            plan.append({'method': 'GET', 'path': path, 'user': user})
+        return plan
+
+    def load_plan(self, path):
+        with open(path) as source:
+            return [json.loads(line) for line in source if line.strip()]
+
+    def credentials(self, plan):
+        """Сессии и токены для пользователей из плана."""
+        engine = import_module(settings.SESSION_ENGINE)
+        result = {}
+        names = {item.get('user') for item in plan} - {None}
+        for user in User.objects.filter(username__in=names):
+            session = engine.SessionStore()
+            session[SESSION_KEY] = user._meta.pk.value_to_string(user)
+            session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+            session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+            session.save()
+            token, _ = Token.objects.get_or_create(user=user)
+            result[user.username] = {
+                'HTTP_COOKIE': (f'{settings.SESSION_COOKIE_NAME}='
+                                f'{session.session_key}'),
+                'HTTP_AUTHORIZATION': f'Token {token.key}',
+            }
+        return result
+
+    def environ(self, item, credentials):
+        url = urlsplit(item['path'])
+        method = item.get('method', 'GET').upper()
+        body = b''
+        query = url.query
+        if item.get('data'):
+            if method == 'GET':
+                query = urlencode(item['data'])
+            else:
+                body = urlencode(item['data']).encode()
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': url.path,
+            'QUERY_STRING': query,
+            'SERVER_NAME': 'testserver',
+            'SERVER_PORT': '80',
+            'REMOTE_ADDR': '192.0.2.1',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': BytesIO(body),
+            'wsgi.errors': BytesIO(),
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        environ.update(credentials.get(item.get('user'), {}))
+        return environ
+
+    def run(self, plan, concurrency):
+        application = import_string(settings.WSGI_APPLICATION)
+        credentials = self.credentials(plan)
+
+        def call(item):
+            queries = []
+
+            def count(execute, sql, params, many, context):
+                queries.append(sql)
+                return execute(sql, params, many, context)
+
+            status = []
+            started = time.perf_counter()
+            with dbwrappers.execute_wrapper(count):
+                response = application(
+                    self.environ(item, credentials),
+                    lambda code, headers, exc_info=None: status.append(code),
+                )
+                for _ in response:
+                    pass
+                if hasattr(response, 'close'):
+                    response.close()
+            elapsed = time.perf_counter() - started
+            try:
+                name = resolve(urlsplit(item['path']).path).url_name
+            except Exception:
+                name = 'unresolved'
+            return name, elapsed, len(queries), status[0].split()[0]
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(call, plan))
+        wall = time.perf_counter() - started
+
+        by_name = defaultdict(list)
+        for name, *result in results:
+            by_name[name].append(result)
+        report = {
+            'total_requests': len(results),
+            'concurrency': concurrency,
+            'wall_time_s': round(wall, 3),
+            'requests_per_second': round(len(results) / wall, 1),
+            'urls': {},
+        }
+        for name, rows in by_name.items():
+            latencies = [row[0] * 1000 for row in rows]
+            statuses = defaultdict(int)
+            for row in rows:
+                statuses[row[2]] += 1
+            report['urls'][name] = {
+                'requests': len(rows),
+                'p50_ms': round(percentile(latencies, 0.50), 2),
+                'p95_ms': round(percentile(latencies, 0.95), 2),
+                'p99_ms': round(percentile(latencies, 0.99), 2),
+                'queries_per_request': round(
+                    sum(row[1] for row in rows) / len(rows), 2
+                ),
+                'requests_per_second': round(len(rows) / wall, 1),
+                'statuses': dict(statuses),
+            }
+        return report
+
+    def print_report(self, report):
+        self.stdout.write(
+            f"{'URL':<16}{'N':>7}{'p50':>9}{'p95':>9}{'p99':>9}"
+            f"{'SQL':>7}{'RPS':>8}"
+        )
+        for name, row in sorted(report['urls'].items()):
+            self.stdout.write(
+                f"{name:<16}{row['requests']:>7}{row['p50_ms']:>9}"
+                f"{row['p95_ms']:>9}{row['p99_ms']:>9}"
+                f"{row['queries_per_request']:>7}"
+                f"{row['requests_per_second']:>8}"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Всего: {report['total_requests']} запросов, "
+            f"{report['requests_per_second']} RPS"
+        ))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from yatube import queries
+
+
+class Command(BaseCommand):
+    help = (
+        'Включает и выключает поиск медленных и повторяющихся SQL-запросов '
+        'во всех воркерах без перезапуска'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('state',
+                            choices=['on', 'off', 'default', 'status'],
+                            help='default — как в настройке QUERY_INSPECTOR')
+
+    def handle(self, *args, **options):
+        state = options['state']
+        if state != 'status':
+            queries.set_enabled(
+                None if state == 'default' else state == 'on'
+            )
+        state = 'включён' if queries.enabled() else 'выключен'
+        self.stdout.write(f'Поиск медленных запросов {state}')
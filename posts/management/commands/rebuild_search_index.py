@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import search
+from posts.models import Comment, Post
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает поисковый индекс постов и комментариев'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        index = search.get_index()
+        chunk_size = options['chunk_size']
+        index.clear()
+        sources = (
+            (search.POST, Post.objects.values_list('pk', 'id', 'text')),
+            (search.COMMENT,
+             Comment.objects.values_list('pk', 'post_id', 'text')),
+        )
+        for kind, rows in sources:
+            total = 0
+            last_pk = 0
+            while True:
+                chunk = list(
+                    rows.filter(pk__gt=last_pk).order_by('pk')[:chunk_size]
+                )
+                if not chunk:
+                    break
+                last_pk = chunk[-1][0]
+                with transaction.atomic():
+                    index.add_many(
+                        (kind, pk, post_id, text)
+                        for pk, post_id, text in chunk
+                    )
+                total += len(chunk)
+                self.stdout.write(f'{kind}: {total}')
+        self.stdout.write(self.style.SUCCESS('Индекс пересобран'))
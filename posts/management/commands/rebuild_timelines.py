@@ -0,0 +1,26 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import timeline
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает материализованные ленты подписок пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*',
+                            help='Только для указанных пользователей')
+
+    def handle(self, *args, **options):
+        if not timeline.enabled():
+            raise CommandError('Включите FOLLOW_TIMELINE в настройках')
+        users = User.objects.filter(follower__isnull=False).distinct()
+        if options['usernames']:
+            users = User.objects.filter(username__in=options['usernames'])
+        total = 0
+        for user in users.iterator():
+            timeline.rebuild(user)
+            total += 1
+        self.stdout.write(self.style.SUCCESS(f'Пересобрано лент: {total}'))
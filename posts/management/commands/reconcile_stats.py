@@ -0,0 +1,48 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import stats
+from posts.models import UserStats
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики профилей и исправляет разошедшиеся'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        users = (
+            User.objects.order_by('pk')
+            .annotate(**stats.count_annotations())
+            .values_list('pk', *stats.FIELDS)
+        )
+        fixed = 0
+        last_pk = 0
+        while True:
+            batch = list(users.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            actual = {
+                pk: UserStats(user_id=pk, **dict(zip(stats.FIELDS, values)))
+                for pk, *values in batch
+            }
+            stored = UserStats.objects.in_bulk(list(actual))
+            drifted = [
+                row for pk, row in actual.items()
+                if pk in stored and any(
+                    getattr(stored[pk], field) != getattr(row, field)
+                    for field in stats.FIELDS
+                )
+            ]
+            missing = [row for pk, row in actual.items() if pk not in stored]
+            with transaction.atomic():
+                UserStats.objects.bulk_update(drifted, stats.FIELDS)
+                UserStats.objects.bulk_create(missing, ignore_conflicts=True)
+            fixed += len(drifted) + len(missing)
+        self.stdout.write(self.style.SUCCESS(f'Исправлено счётчиков: {fixed}'))
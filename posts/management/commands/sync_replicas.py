@@ -0,0 +1,35 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from yatube import replicas
+
+
+class Command(BaseCommand):
+    help = (
+        'Копирует основную базу SQLite в реплики из DATABASE_REPLICAS — '
+        'локальная замена репликации'
+    )
+
+    def handle(self, *args, **options):
+        aliases = replicas.replicas()
+        if not aliases:
+            raise CommandError('В DATABASE_REPLICAS нет реплик')
+        primary = settings.DATABASES[DEFAULT_DB_ALIAS]
+        for alias in aliases:
+            replica = settings.DATABASES[alias]
+            if 'sqlite3' not in replica['ENGINE']:
+                raise CommandError(f'{alias}: поддерживаются только SQLite')
+            source = sqlite3.connect(primary['NAME'])
+            target = sqlite3.connect(replica['NAME'])
+            try:
+                # Онлайн-копия: запись в основную базу не останавливается
+                source.backup(target)
+            finally:
+                target.close()
+                source.close()
+            self.stdout.write(self.style.SUCCESS(
+                f'{alias}: {replica["NAME"]}'
+            ))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from posts import thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Строит миниатюры картинок существующих постов в пуле процессов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None)
+        parser.add_argument('--chunk-size', type=int, default=20)
+
+    def handle(self, *args, **options):
+        names = (
+            Post.objects.exclude(image='').exclude(image__isnull=True)
+            .order_by('pk')
+            .values_list('image', flat=True)
+        )
+        done = failed = 0
+        with thumbnails.make_executor(options['workers']) as executor:
+            results = executor.map(self.generate, names.iterator(),
+                                   chunksize=options['chunk_size'])
+            for ok in results:
+                if ok:
+                    done += 1
+                else:
+                    failed += 1
+                if (done + failed) % 100 == 0:
+                    self.stdout.write(f'Обработано: {done + failed}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Миниатюры построены: {done}, ошибок: {failed}'
+        ))
+
+    @staticmethod
+    def generate(name):
+        try:
+            thumbnails.generate(name)
+        except Exception:
+            return False
+        return True
@@ -0,0 +1,40 @@
+from django.db import migrations
+from django.db.models import Count
+
+BATCH_SIZE = 1000
+
+
+def backfill_comment_count(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    last_pk = 0
+    while True:
+        batch = list(
+            Post.objects.filter(pk__gt=last_pk)
+            .order_by('pk')
+            .only('pk')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        last_pk = batch[-1].pk
+        counts = dict(
+            Comment.objects.filter(post__in=batch)
+            .order_by()
+            .values_list('post')
+            .annotate(total=Count('pk'))
+        )
+        for post in batch:
+            post.comment_count = counts.get(post.pk, 0)
+        Post.objects.bulk_update(batch, ['comment_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0017_post_comment_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_comment_count,
+                             migrations.RunPython.noop),
+    ]
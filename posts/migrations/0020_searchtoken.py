@@ -0,0 +1,32 @@
+# Generated by Django 3.1.2 on 2026-10-18 04:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0019_post_updated'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64)),
+                ('kind', models.CharField(max_length=1)),
+                ('object_id', models.PositiveIntegerField()),
+                ('post_id', models.PositiveIntegerField()),
+                ('weight', models.PositiveIntegerField(default=1)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='searchtoken',
+            index=models.Index(fields=['token'], name='search_token'),
+        ),
+        migrations.AddIndex(
+            model_name='searchtoken',
+            index=models.Index(fields=['kind', 'object_id'], name='search_object'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations
+from django.db.utils import OperationalError
+
+# rowid: 2 * id для поста, 2 * id + 1 для комментария
+CREATE_FTS = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS posts_search USING fts5("
+    "body, post_id UNINDEXED, "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+)
+
+
+def create_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute(CREATE_FTS)
+    except OperationalError:
+        # SQLite собран без FTS5 — поиск работает через SearchToken
+        pass
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS posts_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0020_searchtoken'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, drop_fts),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.1.2 on 2026-10-18 05:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0022_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommentBatch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('flushed', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
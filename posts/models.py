@@ -19,6 +19,7 @@ class Post(models.Model):
 
     text = models.TextField()
     pub_date = models.DateTimeField('date published', auto_now_add=True, db_index=True)
+    updated = models.DateTimeField('date updated', auto_now=True, db_index=True)
     author = models.ForeignKey(User,
                                on_delete=models.CASCADE,
                                related_name='author_posts')
@@ -27,12 +28,20 @@ class Post(models.Model):
                               related_name='group_posts',
                               blank=True, null=True)
     image = models.ImageField(upload_to='posts/', blank=True, null=True)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.text
 
     class Meta:
         ordering = ('-pub_date',)
+        # Ленты группы и автора: фильтр + порядок (pub_date, id) по индексу
+        indexes = [
+            models.Index(fields=['group', '-pub_date', '-id'],
+                         name='post_group_pub_date'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='post_author_pub_date'),
+        ]
 
 
 class Comment(models.Model):
@@ -51,6 +60,10 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ('-created',)
+        indexes = [
+            models.Index(fields=['post', '-created', '-id'],
+                         name='comment_post_created'),
+        ]
 
 
 class Follow(models.Model):
@@ -67,3 +80,81 @@ class Follow(models.Model):
         constraints = [
             UniqueConstraint(fields=['author', 'user'], name='author')
         ]
+        # Уникальный индекс начинается с author; подписки читателя — здесь
+        indexes = [
+            models.Index(fields=['user', 'author'], name='follow_user_author'),
+        ]
+
+
+class TimelineEntry(models.Model):
+    """Пост в материализованной ленте подписок пользователя."""
+
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name='timeline_entries')
+    post = models.ForeignKey(Post,
+                             on_delete=models.CASCADE,
+                             related_name='timeline_entries')
+    pub_date = models.DateTimeField()
+
+    class Meta:
+
+        constraints = [
+            UniqueConstraint(fields=['user', 'post'], name='timeline_entry')
+        ]
+        indexes = [
+            # post — вторая часть ключа ленты (pub_date, id поста)
+            models.Index(fields=['user', '-pub_date', '-post'],
+                         name='timeline_user_pub_post'),
+        ]
+
+
+class UserStats(models.Model):
+    """Денормализованные счётчики профиля, обновляются сигналами."""
+
+    user = models.OneToOneField(User,
+                                on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name='stats')
+    posts_count = models.PositiveIntegerField(default=0)
+    # Сколько пользователей подписано на user
+    followers_count = models.PositiveIntegerField(default=0)
+    # На скольких авторов подписан user
+    following_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return str(self.user_id)
+
+
+class SearchToken(models.Model):
+    """
+    Обратный индекс для поиска без FTS5: слово -> пост или комментарий.
+    kind: 'p' — пост, 'c' — комментарий; post_id — пост для выдачи.
+    """
+
+    token = models.CharField(max_length=64)
+    kind = models.CharField(max_length=1)
+    object_id = models.PositiveIntegerField()
+    post_id = models.PositiveIntegerField()
+    weight = models.PositiveIntegerField(default=1)
+
+    class Meta:
+
+        indexes = [
+            models.Index(fields=['token'], name='search_token'),
+            models.Index(fields=['kind', 'object_id'], name='search_object'),
+        ]
+
+
+class CommentBatch(models.Model):
+    """
+    Файл журнала комментариев (posts/ingest.py), уже записанный в базу.
+    Пишется в той же транзакции, что и комментарии, поэтому повторный
+    разбор файла после сбоя не создаёт дублей.
+    """
+
+    name = models.CharField(max_length=100, unique=True)
+    flushed = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,284 @@
+import base64
+import binascii
+import hashlib
+import heapq
+from collections.abc import Sequence
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from . import aio
+
+# Порядок ленты: (pub_date, id) по убыванию, id нужен для однозначности
+FEED_ORDERING = ('-pub_date', '-id')
+# Комментарии: новые сверху, по индексу comment_post_created
+COMMENT_ORDERING = ('-created', '-id')
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(post, direction=NEXT, field='pub_date'):
+    """
+    Непрозрачный токен позиции в ленте по ключу (pub_date, id).
+    post — объект Post или строка values() с ключами pub_date и id;
+    field — другое поле даты ключа (created у комментариев).
+    """
+    if isinstance(post, dict):
+        moment, pk = post[field], post['id']
+    else:
+        moment, pk = getattr(post, field), post.pk
+    raw = f'{direction}|{moment.isoformat()}|{pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        direction, pub_date, pk = raw.split('|')
+        pub_date = parse_datetime(pub_date)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise InvalidCursor(token)
+    if direction not in (NEXT, PREVIOUS) or pub_date is None:
+        raise InvalidCursor(token)
+    return direction, pub_date, pk
+
+
+class CursorPage(Sequence):
+    """Страница ленты, полученная по курсору, без OFFSET и COUNT(*)."""
+
+    number = None
+
+    def __init__(self, object_list, paginator, next_cursor=None,
+                 previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return '<CursorPage of %s items>' % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Keyset-пагинация по (pub_date, id): каждая страница — один запрос
+    по индексу pub_date, время ответа не зависит от глубины ленты.
+    Общее количество записей приблизительное и берётся из кэша.
+    """
+
+    def __init__(self, object_list, per_page, count_timeout=None,
+                 count=None):
+        # count — известное количество записей или функция, которая его
+        # вернёт
+        self.object_list = object_list.order_by(*FEED_ORDERING)
+        self.per_page = int(per_page)
+        self.known_count = count
+        if count_timeout is None:
+            count_timeout = getattr(settings, 'FEED_COUNT_CACHE_TIMEOUT', 60)
+        self.count_timeout = count_timeout
+
+    @property
+    def count(self):
+        """Приблизительное количество записей (кэшируется на count_timeout)."""
+        if callable(self.known_count):
+            return self.known_count()
+        if self.known_count is not None:
+            return self.known_count
+        query = str(self.object_list.query).encode()
+        key = 'feed-count:' + hashlib.md5(query).hexdigest()
+        return cache.get_or_set(key, self.object_list.count,
+                                self.count_timeout)
+
+    def page(self, cursor=None):
+        if not cursor:
+            return self._forward(self._rows(), has_previous=False)
+        direction, pub_date, pk = decode_cursor(cursor)
+        items = self._rows(direction, pub_date, pk)
+        if direction == NEXT:
+            return self._forward(items, has_previous=True)
+        return self._backward(items)
+
+    def get_page(self, cursor=None):
+        try:
+            return self.page(cursor)
+        except InvalidCursor:
+            return self.page()
+
+    def _rows(self, direction=NEXT, pub_date=None, pk=None):
+        """
+        До per_page + 1 постов после позиции (pub_date, pk) в сторону
+        direction; без позиции — с начала ленты.
+        """
+        queryset = _after(self.object_list, 'id', direction, pub_date, pk)
+        return list(queryset[:self.per_page + 1])
+
+    def _forward(self, items, has_previous):
+        has_next = len(items) > self.per_page
+        items = items[:self.per_page]
+        return self._make_page(items, has_next, has_previous and bool(items))
+
+    def _backward(self, items):
+        has_previous = len(items) > self.per_page
+        items = items[:self.per_page][::-1]
+        return self._make_page(items, bool(items), has_previous)
+
+    def _make_page(self, items, has_next, has_previous):
+        next_cursor = encode_cursor(items[-1]) if has_next else None
+        previous_cursor = (encode_cursor(items[0], PREVIOUS)
+                           if has_previous else None)
+        return CursorPage(items, self, next_cursor, previous_cursor)
+
+
+class MergedCursorPaginator(CursorPaginator):
+    """
+    Keyset-пагинация по объединению нескольких лент. sources — пары
+    (queryset, поле id поста): из каждого источника берётся per_page + 1
+    ключей (pub_date, id) по его индексу, ключи сливаются без сортировки
+    в базе, а посты страницы выбираются из object_list по id.
+    """
+
+    def __init__(self, object_list, sources, per_page, count=None):
+        super().__init__(object_list, per_page, count=count)
+        self.sources = sources
+
+    def _rows(self, direction=NEXT, pub_date=None, pk=None):
+        streams = [
+            list(_after(queryset, key, direction, pub_date, pk)
+                 .values_list('pub_date', key)[:self.per_page + 1])
+            for queryset, key in self.sources
+        ]
+        keys = []
+        for key in heapq.merge(*streams, reverse=direction == NEXT):
+            # Один пост может прийти из двух источников
+            if keys and keys[-1] == key:
+                continue
+            keys.append(key)
+            if len(keys) > self.per_page:
+                break
+        ids = [pk for _, pk in keys]
+        posts = self.object_list.filter(pk__in=ids).order_by().in_bulk()
+        return [posts[pk] for pk in ids if pk in posts]
+
+
+def _after(queryset, key, direction, pub_date, pk):
+    """queryset в порядке ленты после позиции (pub_date, pk)."""
+    if pub_date is None:
+        return queryset.order_by('-pub_date', '-' + key)
+    if direction == NEXT:
+        return queryset.filter(
+            Q(pub_date__lt=pub_date)
+            | Q(pub_date=pub_date, **{key + '__lt': pk})
+        ).order_by('-pub_date', '-' + key)
+    return queryset.filter(
+        Q(pub_date__gt=pub_date)
+        | Q(pub_date=pub_date, **{key + '__gt': pk})
+    ).order_by('pub_date', key)
+
+
+def comment_page(queryset, per_page, cursor=None, total=None):
+    """
+    Страница комментариев по курсору (created, id) с авторами — один
+    запрос ровно на per_page строк, сколько бы комментариев ни было.
+    object_list остаётся выполненным QuerySet.
+
+    Курсор следующей страницы выдаётся, если страница заполнена целиком;
+    известное число комментариев (total, Post.comment_count) уточняет
+    это для первой страницы. Неверный курсор — InvalidCursor.
+    """
+    queryset = queryset.select_related('author').order_by(*COMMENT_ORDERING)
+    if cursor:
+        direction, created, pk = decode_cursor(cursor)
+        if direction != NEXT:
+            raise InvalidCursor(cursor)
+        queryset = queryset.filter(
+            Q(created__lt=created) | Q(created=created, id__lt=pk)
+        )
+    comments = queryset[:per_page]
+    shown = len(comments)
+    full = shown == per_page and (cursor or total is None
+                                  or total > per_page)
+    next_cursor = (encode_cursor(comments[shown - 1], field='created')
+                   if full else None)
+    return CursorPage(comments, None, next_cursor)
+
+
+def _first_page(paginator, rows, count):
+    """
+    Первая страница ленты как обычный Page из строк, выбранных с запасом
+    в одну. count (приблизительный) нужен, только если строк больше
+    страницы; иначе количество известно точно.
+    """
+    per_page = paginator.per_page
+    has_next = len(rows) > per_page
+    first = Paginator(paginator.object_list, per_page)
+    first.count = max(count, per_page + 1) if has_next else len(rows)
+    page = Page(rows[:per_page], 1, first)
+    page.next_cursor = encode_cursor(rows[per_page - 1]) if has_next else None
+    page.previous_cursor = None
+    return first, page
+
+
+def paginate(request, object_list, per_page, count=None):
+    """
+    Возвращает (paginator, page) для ленты постов.
+
+    Листать ленту можно только по курсору (?cursor=), номер страницы
+    не читается: без курсора отдаётся первая страница. Она остаётся
+    обычными Page и Paginator, но без OFFSET и COUNT(*): количество
+    записей приблизительное из CursorPaginator.count, а известное
+    заранее (count) избавляет и от него.
+    """
+    return paginate_with(request,
+                         CursorPaginator(object_list, per_page, count=count))
+
+
+def paginate_with(request, paginator):
+    """paginate() с готовым CursorPaginator."""
+    cursor = request.GET.get('cursor')
+    if cursor:
+        return paginator, paginator.get_page(cursor)
+    rows = paginator._rows()
+    count = paginator.count if len(rows) > paginator.per_page else None
+    return _first_page(paginator, rows, count)
+
+
+async def apaginate(request, object_list, per_page, count=None):
+    """
+    paginate() для асинхронных views: строки первой страницы и
+    приблизительное количество записей выбираются одновременно, а
+    известное заранее количество (count) просто передаётся в страницу.
+    """
+    paginator = CursorPaginator(object_list, per_page, count=count)
+    if request.GET.get('cursor'):
+        return await aio.run(paginate_with, request, paginator)
+    if count is None:
+        count, rows = await aio.gather(lambda: paginator.count,
+                                       paginator._rows)
+    else:
+        rows = await aio.run(paginator._rows)
+    return _first_page(paginator, rows, count)
@@ -0,0 +1,181 @@
+"""
+Полнотекстовый поиск по постам и комментариям.
+
+На SQLite с FTS5 индекс лежит в виртуальной таблице posts_search
+(см. миграцию 0021), ранжирование — bm25. Иначе используется обратный
+индекс в модели SearchToken, который разбирается и ранжируется на Python.
+Индекс обновляется сигналами при сохранении и удалении постов и
+комментариев; manage.py rebuild_search_index пересобирает его целиком.
+
+Запрос — слова через пробел, все должны встретиться; слово со звёздочкой
+на конце (`прив*`) ищется по префиксу.
+"""
+import re
+from collections import Counter, defaultdict
+
+from django.db import connection, transaction
+
+from .models import SearchToken
+
+POST = 'p'
+COMMENT = 'c'
+MAX_RESULTS = 200
+TOKEN_LENGTH = 64
+
+WORD_RE = re.compile(r'\w+\*?')
+
+_fts_available = None
+
+
+def tokenize(text):
+    return [word[:TOKEN_LENGTH] for word in re.findall(r'\w+', text.lower())]
+
+
+def parse_query(query):
+    """Список (слово, префикс ли) из пользовательского запроса."""
+    terms = []
+    for word in WORD_RE.findall(query.lower()):
+        prefix = word.endswith('*')
+        word = word.rstrip('*')[:TOKEN_LENGTH]
+        if word:
+            terms.append((word, prefix))
+    return terms
+
+
+def _rowid(kind, object_id):
+    return object_id * 2 + (1 if kind == COMMENT else 0)
+
+
+class FTS5Index:
+
+    def add(self, kind, object_id, post_id, text):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT OR REPLACE INTO posts_search (rowid, body, post_id) '
+                'VALUES (%s, %s, %s)',
+                [_rowid(kind, object_id), text, post_id],
+            )
+
+    def add_many(self, rows):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT OR REPLACE INTO posts_search (rowid, body, post_id) '
+                'VALUES (%s, %s, %s)',
+                [(_rowid(kind, object_id), text, post_id)
+                 for kind, object_id, post_id, text in rows],
+            )
+
+    def remove(self, kind, object_id):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM posts_search WHERE rowid = %s',
+                           [_rowid(kind, object_id)])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM posts_search')
+
+    def search(self, terms, limit):
+        match = ' '.join(
+            '"%s"%s' % (word.replace('"', '""'), '*' if prefix else '')
+            for word, prefix in terms
+        )
+        # Пост и его комментарии — разные строки индекса; дубли убираются
+        # здесь, потому что bm25 нельзя использовать внутри GROUP BY
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT post_id FROM posts_search WHERE posts_search MATCH %s '
+                'ORDER BY rank LIMIT %s',
+                [match, limit * 4],
+            )
+            post_ids = dict.fromkeys(row[0] for row in cursor.fetchall())
+        return list(post_ids)[:limit]
+
+
+class TokenIndex:
+
+    def _tokens(self, kind, object_id, post_id, text):
+        return [
+            SearchToken(token=token, kind=kind, object_id=object_id,
+                        post_id=post_id, weight=weight)
+            for token, weight in Counter(tokenize(text)).items()
+        ]
+
+    def add(self, kind, object_id, post_id, text):
+        with transaction.atomic():
+            self.remove(kind, object_id)
+            SearchToken.objects.bulk_create(
+                self._tokens(kind, object_id, post_id, text)
+            )
+
+    def add_many(self, rows):
+        tokens = []
+        for row in rows:
+            tokens.extend(self._tokens(*row))
+        SearchToken.objects.bulk_create(tokens, batch_size=1000)
+
+    def remove(self, kind, object_id):
+        SearchToken.objects.filter(kind=kind, object_id=object_id).delete()
+
+    def clear(self):
+        SearchToken.objects.all().delete()
+
+    def search(self, terms, limit):
+        scores = None
+        for word, prefix in terms:
+            if prefix:
+                matches = SearchToken.objects.filter(
+                    token__gte=word, token__lt=word + '\uffff'
+                )
+            else:
+                matches = SearchToken.objects.filter(token=word)
+            rows = list(matches.values_list('kind', 'object_id', 'post_id',
+                                            'weight'))
+            documents = {(kind, object_id) for kind, object_id, *_ in rows}
+            if not documents:
+                return []
+            term_scores = defaultdict(float)
+            for kind, object_id, post_id, weight in rows:
+                # Редкое слово весит больше частого
+                term_scores[post_id] += weight / len(documents)
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {post_id: score + term_scores[post_id]
+                          for post_id, score in scores.items()
+                          if post_id in term_scores}
+        ranked = sorted(scores.items(), key=lambda item: -item[1])
+        return [post_id for post_id, _ in ranked[:limit]]
+
+
+def fts_available():
+    global _fts_available
+    if _fts_available is None:
+        _fts_available = (
+            connection.vendor == 'sqlite'
+            and 'posts_search' in connection.introspection.table_names()
+        )
+    return _fts_available
+
+
+def get_index():
+    return FTS5Index() if fts_available() else TokenIndex()
+
+
+def index_post(post):
+    get_index().add(POST, post.pk, post.pk, post.text)
+
+
+def index_comment(comment):
+    get_index().add(COMMENT, comment.pk, comment.post_id, comment.text)
+
+
+def remove(kind, object_id):
+    get_index().remove(kind, object_id)
+
+
+def search(query, limit=MAX_RESULTS):
+    """id постов, подходящих под запрос, от более релевантных к менее."""
+    terms = parse_query(query)
+    if not terms:
+        return []
+    return get_index().search(terms, limit)
@@ -1,3 +1,4 @@
+from django.core.files.storage import default_storage
 from rest_framework import serializers
 from .models import Post
 
@@ -6,3 +7,51 @@ class PostSerializer(serializers.ModelSerializer):
     class Meta:
         fields = ('text', 'author', 'pub_date')
         model = Post
+
+
+# Поля быстрой сериализации: имя в ответе -> поле для values().
+# Автор и группа подтягиваются JOIN-ом в том же запросе.
+POST_FIELDS = {
+    'id': 'id',
+    'text': 'text',
+    'pub_date': 'pub_date',
+    'author': 'author_id',
+    'author_username': 'author__username',
+    'group': 'group_id',
+    'group_slug': 'group__slug',
+    'image': 'image',
+    'comment_count': 'comment_count',
+}
+
+
+def parse_fields(value):
+    """Список полей из ?fields=; ValueError для неизвестных."""
+    if not value:
+        return list(POST_FIELDS)
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = set(fields) - set(POST_FIELDS)
+    if unknown:
+        raise ValueError(', '.join(sorted(unknown)))
+    return fields
+
+
+def post_values(queryset, fields):
+    """
+    values()-queryset с выбранными полями; id и pub_date выбираются
+    всегда, они нужны для курсора.
+    """
+    lookups = {POST_FIELDS[field] for field in fields} | {'id', 'pub_date'}
+    return queryset.values(*lookups)
+
+
+def serialize_post_rows(rows, fields):
+    """Словари для JSON без накладных расходов DRF на каждое поле."""
+    result = []
+    for row in rows:
+        item = {field: row[POST_FIELDS[field]] for field in fields}
+        if item.get('image'):
+            item['image'] = default_storage.url(item['image'])
+        elif 'image' in item:
+            item['image'] = None
+        result.append(item)
+    return result
@@ -0,0 +1,130 @@
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import cards, feeds, follows, search, stats, timeline
+from .models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Post)
+def post_created(sender, instance, created, **kwargs):
+    if created:
+        stats.bump(instance.author_id, 'posts_count', 1)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    stats.bump(instance.author_id, 'posts_count', -1)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        stats.bump(instance.author_id, 'followers_count', 1)
+        stats.bump(instance.user_id, 'following_count', 1)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    stats.bump(instance.author_id, 'followers_count', -1)
+    stats.bump(instance.user_id, 'following_count', -1)
+    timeline.follower_removed(instance.author_id)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def follow_graph_changed(sender, instance, **kwargs):
+    follows.invalidate(instance.user_id)
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, **kwargs):
+    if created:
+        Post.objects.filter(pk=instance.post_id).update(
+            comment_count=F('comment_count') + 1, updated=timezone.now()
+        )
+        _comments_changed(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    Post.objects.filter(pk=instance.post_id).update(
+        comment_count=F('comment_count') - 1, updated=timezone.now()
+    )
+    _comments_changed(instance)
+
+
+def _comments_changed(comment):
+    cards.bump('post', comment.post_id)
+    if Comment.post.is_cached(comment):
+        owner = comment.post.author_id, comment.post.group_id
+    else:
+        owner = Post.objects.filter(pk=comment.post_id).values_list(
+            'author_id', 'group_id').first()
+    # Пост удаляется вместе с комментариями: ленты сдвинет post_delete
+    if owner is not None:
+        cards.bump_feeds(*owner)
+
+
+@receiver(pre_save, sender=Post)
+def post_moving(sender, instance, **kwargs):
+    # При переносе поста в другую группу меняется и лента старой группы
+    if instance._state.adding:
+        return
+    group_id = Post.objects.filter(pk=instance.pk).values_list(
+        'group_id', flat=True).first()
+    if group_id is not None and group_id != instance.group_id:
+        cards.bump('group-feed', group_id)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_changed(sender, instance, **kwargs):
+    cards.bump('post', instance.pk)
+    cards.bump_feeds(instance.author_id, instance.group_id)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def author_window_changed(sender, instance, **kwargs):
+    feeds.forget_author_window(instance.author_id)
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, update_fields=None, **kwargs):
+    # Вход пользователя сохраняет только last_login: карточки те же
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    cards.bump('user', instance.pk)
+    cards.bump('users', 'all')
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    cards.bump('group', instance.pk)
+    cards.bump('groups', 'all')
+
+
+@receiver(post_save, sender=Post)
+def post_indexed(sender, instance, **kwargs):
+    search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def post_unindexed(sender, instance, **kwargs):
+    search.remove(search.POST, instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+def comment_indexed(sender, instance, **kwargs):
+    search.index_comment(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_unindexed(sender, instance, **kwargs):
+    search.remove(search.COMMENT, instance.pk)
@@ -0,0 +1,87 @@
+"""
+Счётчики профиля: количество постов, подписчиков и подписок.
+
+Строка UserStats создаётся при первом обращении (по реальным данным),
+дальше её поддерживают сигналы из posts/signals.py. Разошедшиеся
+счётчики пересобирает manage.py reconcile_stats.
+"""
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, router, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Follow, Post, UserStats
+
+FIELDS = ('posts_count', 'followers_count', 'following_count')
+
+
+def _counted(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')})
+        .order_by()
+        .values(field)
+        .annotate(total=Count('pk'))
+        .values('total')
+    ), 0)
+
+
+def count_annotations():
+    """Аннотации для User с актуальными значениями счётчиков."""
+    return {
+        'posts_count': _counted(Post, 'author'),
+        'followers_count': _counted(Follow, 'author'),
+        'following_count': _counted(Follow, 'user'),
+    }
+
+
+def get_stats(user):
+    """
+    Счётчики пользователя (объект или id); при отсутствии строки считает
+    их заново.
+    """
+    user_id = getattr(user, 'pk', user)
+    try:
+        return UserStats.objects.get(user_id=user_id)
+    except UserStats.DoesNotExist:
+        pass
+    if router.db_for_read(UserStats) == DEFAULT_DB_ALIAS:
+        return _create(user_id)
+    # Реплика могла ещё не получить строку: читаем и создаём в основной
+    # базе, явно — без роутера, чтобы чтение не закрепляло клиента за
+    # основной базой (yatube/replicas.py)
+    try:
+        return UserStats.objects.using(DEFAULT_DB_ALIAS).get(user_id=user_id)
+    except UserStats.DoesNotExist:
+        return _create(user_id)
+
+
+def _create(user_id):
+    primary = DEFAULT_DB_ALIAS
+    defaults = {
+        'posts_count': Post.objects.using(primary)
+        .filter(author_id=user_id).count(),
+        'followers_count': Follow.objects.using(primary)
+        .filter(author_id=user_id).count(),
+        'following_count': Follow.objects.using(primary)
+        .filter(user_id=user_id).count(),
+    }
+    try:
+        with transaction.atomic(using=primary):
+            return UserStats.objects.using(primary).create(user_id=user_id,
+                                                          **defaults)
+    except IntegrityError:
+        # Строку успел создать параллельный запрос
+        return UserStats.objects.using(primary).get(user_id=user_id)
+
+
+def recount(user_ids, field):
+    """Пересчитывает счётчик field пользователей user_ids по данным."""
+    UserStats.objects.filter(user_id__in=user_ids).update(
+        **{field: count_annotations()[field]}
+    )
+
+
+def bump(user_id, field, delta):
+    """Атомарно сдвигает счётчик; строки ещё нет — посчитается при чтении."""
+    UserStats.objects.filter(user_id=user_id).update(
+        **{field: F(field) + delta}
+    )
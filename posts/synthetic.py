@@ -0,0 +1,254 @@
+"""
+Генератор синтетических данных для проверки производительности.
+
+Распределения приближены к реальным: число подписчиков у авторов
+подчиняется степенному закону (Zipf) — у немногих авторов их тысячи,
+у большинства единицы; активные авторы пишут чаще; посты выходят
+всплесками вокруг случайных моментов, комментарии приходят к ним
+с экспоненциальной задержкой и тоже собираются у популярных авторов.
+
+Всё пишется через bulk_create, поэтому сигналы не срабатывают:
+derive() пересчитывает то, что они обычно поддерживают.
+"""
+import math
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from io import StringIO
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import timeline
+from .models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+BATCH_SIZE = 5000
+GROUPS = 20
+# Показатель степенного закона популярности авторов
+ZIPF_EXPONENT = 1.1
+# Средний размер всплеска постов и его длительность
+BURST_SIZE = 20
+BURST_SPAN = timedelta(hours=3)
+# Среднее время до комментария
+COMMENT_DELAY = timedelta(hours=6)
+PASSWORD = 'synthetic'
+
+WORDS = (
+    'кот собака солнце дождь город море книга кофе утро вечер работа '
+    'отпуск поезд музыка фильм друг семья лес река гора снег лето зима '
+    'весна осень сад дом окно дорога небо звезда ветер ночь день'
+).split()
+
+
+def zipf_weights(count, exponent=ZIPF_EXPONENT):
+    """Накопленные веса 1/rank^s для random.choices(cum_weights=...)."""
+    return list(accumulate(1 / (rank ** exponent)
+                           for rank in range(1, count + 1)))
+
+
+def sentence(rnd, low=3, high=20):
+    return ' '.join(rnd.choices(WORDS, k=rnd.randint(low, high))).capitalize()
+
+
+def batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+@contextmanager
+def explicit_dates():
+    """Отключает auto_now, чтобы bulk_create сохранил заданные даты."""
+    fields = [
+        (Post._meta.get_field('pub_date'), 'auto_now_add'),
+        (Post._meta.get_field('updated'), 'auto_now'),
+        (Comment._meta.get_field('created'), 'auto_now_add'),
+    ]
+    saved = [getattr(field, name) for field, name in fields]
+    for field, name in fields:
+        setattr(field, name, False)
+    try:
+        yield
+    finally:
+        for (field, name), value in zip(fields, saved):
+            setattr(field, name, value)
+
+
+class Generator:
+    """
+    Создаёт users пользователей, posts постов, около follows подписок
+    и comments комментариев. progress(label, done, total) вызывается
+    после каждой пачки.
+    """
+
+    def __init__(self, users, posts, follows, comments, days=365,
+                 prefix='synthetic', seed=0, batch_size=BATCH_SIZE,
+                 progress=None):
+        self.counts = {'users': users, 'posts': posts,
+                       'follows': follows, 'comments': comments}
+        self.days = days
+        self.prefix = prefix
+        self.random = random.Random(seed)
+        self.batch_size = batch_size
+        self.progress = progress or (lambda label, done, total: None)
+        self.now = timezone.now()
+
+    def run(self):
+        with explicit_dates():
+            users = self.create_users()
+            if not users:
+                return
+            # Популярность авторов: случайный порядок рангов Zipf
+            self.random.shuffle(users)
+            self.authors = users
+            self.author_weights = zipf_weights(len(users))
+            self.create_follows(users)
+            groups = self.create_groups()
+            self.create_posts(groups)
+            self.create_comments(users)
+
+    def insert(self, label, model, rows, total, **options):
+        done = 0
+        for batch in batched(rows, self.batch_size):
+            model.objects.bulk_create(batch, batch_size=self.batch_size,
+                                      **options)
+            done += len(batch)
+            self.progress(label, done, total)
+
+    def create_users(self):
+        start = User.objects.filter(
+            username__startswith=self.prefix + '_'
+        ).count()
+        total = self.counts['users']
+        # Хэш пароля один на всех: make_password медленный намеренно
+        password = make_password(PASSWORD)
+        self.insert('users', User, (
+            User(username=f'{self.prefix}_{start + i}', password=password)
+            for i in range(total)
+        ), total)
+        return list(
+            User.objects.filter(username__startswith=self.prefix + '_')
+            .order_by('pk').values_list('pk', flat=True)[start:]
+        )
+
+    def create_groups(self):
+        rnd = self.random
+        existing = set(Group.objects.values_list('slug', flat=True))
+        new = [
+            Group(title=f'Группа {i}', slug=slug,
+                  description=sentence(rnd))
+            for i, slug in ((i, f'{self.prefix}-{i}') for i in range(GROUPS))
+            if slug not in existing
+        ]
+        Group.objects.bulk_create(new)
+        return list(Group.objects.filter(
+            slug__startswith=self.prefix + '-'
+        ).values_list('pk', flat=True))
+
+    def create_follows(self, users):
+        rnd = self.random
+        total = self.counts['follows']
+        mean = total / len(users)
+
+        def rows():
+            for user in users:
+                # Число подписок у читателя — геометрическое со средним mean
+                wanted = int(math.log(1 - rnd.random()) * -mean)
+                authors = set(rnd.choices(self.authors,
+                                          cum_weights=self.author_weights,
+                                          k=wanted))
+                authors.discard(user)
+                for author in authors:
+                    yield Follow(user_id=user, author_id=author)
+
+        self.insert('follows', Follow, rows(), total, ignore_conflicts=True)
+
+    def bursts(self, total):
+        """Моменты публикации: всплески вокруг случайных точек времени."""
+        rnd = self.random
+        span = timedelta(days=self.days).total_seconds()
+        produced = 0
+        while produced < total:
+            centre = self.now - timedelta(seconds=rnd.random() * span)
+            size = min(total - produced,
+                       1 + int(rnd.expovariate(1 / BURST_SIZE)))
+            for _ in range(size):
+                offset = rnd.random() * BURST_SPAN.total_seconds()
+                yield min(self.now, centre + timedelta(seconds=offset))
+            produced += size
+
+    def create_posts(self, groups):
+        rnd = self.random
+        total = self.counts['posts']
+
+        def rows():
+            for pub_date in self.bursts(total):
+                author = rnd.choices(self.authors,
+                                     cum_weights=self.author_weights)[0]
+                group = rnd.choice(groups) if rnd.random() < 0.5 else None
+                yield Post(text=sentence(rnd, 5, 60), author_id=author,
+                           group_id=group, pub_date=pub_date,
+                           updated=pub_date)
+
+        self.insert('posts', Post, rows(), total)
+
+    def create_comments(self, users):
+        rnd = self.random
+        total = self.counts['comments']
+        posts = list(
+            Post.objects.filter(author__in=self.authors)
+            .values_list('pk', 'author', 'pub_date')
+        )
+        if not posts or not total:
+            return
+        rank = {author: index for index, author in enumerate(self.authors)}
+        # Комментируют чаще посты популярных авторов
+        weights = list(accumulate(
+            1 / ((rank[author] + 1) ** ZIPF_EXPONENT)
+            for _, author, _ in posts
+        ))
+        delay = COMMENT_DELAY.total_seconds()
+
+        def rows():
+            for _ in range(total):
+                post_id, _, pub_date = rnd.choices(posts,
+                                                   cum_weights=weights)[0]
+                created = min(self.now, pub_date + timedelta(
+                    seconds=rnd.expovariate(1 / delay)
+                ))
+                yield Comment(text=sentence(rnd), post_id=post_id,
+                              author_id=rnd.choice(users), created=created)
+
+        self.insert('comments', Comment, rows(), total)
+
+
+def derive():
+    """
+    Пересчитывает то, что поддерживают сигналы: счётчики комментариев
+    и профилей, поисковый индекс и, если включены, ленты подписок, —
+    и очищает кэш.
+    """
+    Post.objects.update(comment_count=Coalesce(Subquery(
+        Comment.objects.filter(post=OuterRef('pk')).order_by()
+        .values('post').annotate(total=Count('pk')).values('total')
+    ), 0))
+    quiet = {'stdout': StringIO()}
+    call_command('reconcile_stats', **quiet)
+    call_command('rebuild_search_index', **quiet)
+    if timeline.enabled():
+        call_command('rebuild_timelines', **quiet)
+    # Поколения карточек и страниц bulk_create не сдвигал
+    cache.clear()
@@ -0,0 +1,12 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from posts.cards import render_card
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def post_card(context, post):
+    """Карточка поста из фрагментного кэша."""
+    return mark_safe(render_card(post, context.get('user')))
@@ -1,13 +1,64 @@
+import asyncio
+import json
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from PIL import Image
+
+from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.core.cache import cache
+from django.core.cache import cache, caches
+from django.core.handlers.asgi import ASGIHandler
+from django.http import HttpResponse
+from django.template.backends.django import Template
+from django.core.management import call_command
 from django.contrib.auth import get_user_model
-from django.test import Client, TestCase
+from django.db import connection, connections, router
+from asgiref.sync import async_to_sync
+from django.test import (AsyncClient, Client, RequestFactory, SimpleTestCase,
+                          TestCase, TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from rest_framework.authtoken.models import Token
+
+from yatube import dbwrappers, metrics, queries, replicas
+from yatube.cache import SQLiteCache
+from yatube.sqlite3.base import DatabaseWrapper
 
-from .models import Post, Group, Comment, Follow
+from . import (aio, cards, conditional, follows, ingest, search, stats,
+               synthetic, thumbnails, timeline, views)
+from .feeds import post_cards
+from .models import Post, Group, Comment, Follow, TimelineEntry, UserStats
+from .paginators import CursorPaginator, encode_cursor
 
 User = get_user_model()
 
+_isolated_cache = []
+
+
+def setUpModule():
+    # cache.clear() в тестах не должен стирать общий кэш сайта
+    # (BASE_DIR/cache.sqlite3): у тестов свой файл во временном каталоге
+    directory = tempfile.TemporaryDirectory()
+    location = os.path.join(directory.name, "cache.sqlite3")
+    override = override_settings(CACHES={
+        "default": {**settings.CACHES["default"], "LOCATION": location},
+    })
+    override.enable()
+    _isolated_cache.extend([override, directory])
+
+
+def tearDownModule():
+    override, directory = _isolated_cache
+    override.disable()
+    directory.cleanup()
+
 
 class ProfileTest(TestCase):
     def setUp(self):
@@ -271,3 +322,1530 @@ class ProfileTest(TestCase):
                    ' Файл, который вы загрузили,'
                    ' поврежден или не является изображением.'
         )
+
+
+class CursorPaginationTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="reader")
+        Post.objects.bulk_create(
+            Post(text=f"post {i}", author=self.user) for i in range(25)
+        )
+        cache.clear()
+
+    def walk(self, url):
+        seen = []
+        response = self.client.get(url)
+        page = response.context["page"]
+        seen.extend(page.object_list)
+        while page.has_next():
+            response = self.client.get(url, {"cursor": page.next_cursor})
+            self.assertEqual(response.status_code, 200)
+            page = response.context["page"]
+            seen.extend(page.object_list)
+        return seen
+
+    def test_cursor_walk_covers_feed_in_order(self):
+        seen = self.walk(reverse("index"))
+        expected = list(Post.objects.order_by("-pub_date", "-id"))
+        self.assertEqual(seen, expected)
+
+    def test_previous_cursor_returns_previous_page(self):
+        first = self.client.get(reverse("index")).context["page"]
+        second = self.client.get(
+            reverse("index"), {"cursor": first.next_cursor}
+        ).context["page"]
+        back = self.client.get(
+            reverse("index"), {"cursor": second.previous_cursor}
+        ).context["page"]
+        self.assertEqual(list(back), list(first.object_list))
+        self.assertFalse(back.has_previous())
+
+    def test_broken_cursor_falls_back_to_first_page(self):
+        response = self.client.get(reverse("index"), {"cursor": "garbage"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["page"]), 10)
+
+    def test_page_number_is_ignored_without_offset_or_count(self):
+        first = self.client.get(reverse("index")).context["page"]
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("index"), {"page": 3})
+        self.assertEqual(list(response.context["page"]),
+                         list(first.object_list))
+        sql = [query["sql"].upper() for query in queries]
+        self.assertFalse([q for q in sql if "OFFSET" in q])
+        # Приблизительное количество: один COUNT, потом из кэша
+        self.assertEqual(len([q for q in sql if "COUNT(*)" in q]), 1)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("index"))
+        self.assertFalse([q for q in queries
+                          if "COUNT(*)" in q["sql"].upper()])
+        self.assertNotContains(response, "page=")
+
+
+class FeedQueryBudgetTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="reader")
+        self.client.force_login(self.user)
+        self.group = Group.objects.create(title="test", slug="tt",
+                                          description="test")
+        # Лента подписок читает каждого автора отдельно: их число
+        # постоянно, растёт только число постов
+        self.authors = [User.objects.create_user(username=f"author_{i}")
+                        for i in range(2)]
+        for author in self.authors:
+            Follow.objects.create(user=self.user, author=author)
+        cache.clear()
+
+    def add_posts(self, count):
+        start = Post.objects.count()
+        for i in range(start, start + count):
+            post = Post.objects.create(text=f"post {i}",
+                                       author=self.authors[i % 2],
+                                       group=self.group)
+            Comment.objects.create(text="comment", author=self.user,
+                                   post=post)
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_feed_queries_do_not_grow_with_page_size(self):
+        urls = [
+            reverse("index"),
+            reverse("group", kwargs={"slug": self.group.slug}),
+            reverse("follow_index"),
+        ]
+        self.add_posts(2)
+        small = [self.count_queries(url) for url in urls]
+        self.add_posts(8)
+        full = [self.count_queries(url) for url in urls]
+        self.assertEqual(small, full,
+                         msg="Количество запросов растёт с числом постов")
+
+
+@override_settings(FOLLOW_TIMELINE=True, FOLLOW_TIMELINE_FANOUT_LIMIT=1)
+class FollowTimelineTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="reader")
+        self.client.force_login(self.user)
+        self.author = User.objects.create_user(username="writer")
+        self.old_post = Post.objects.create(text="before follow",
+                                            author=self.author)
+        cache.clear()
+
+    def feed(self):
+        response = self.client.get(reverse("follow_index"))
+        return list(response.context["page"].object_list)
+
+    def publish(self, client, text):
+        client.post(reverse("new_post"), {"text": text})
+        return Post.objects.get(text=text)
+
+    def test_follow_backfills_and_new_post_fans_out(self):
+        self.client.get(reverse("profile_follow", args=[self.author]))
+        self.assertEqual(self.feed(), [self.old_post])
+        author_client = Client()
+        author_client.force_login(self.author)
+        new_post = self.publish(author_client, "after follow")
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.user, post=new_post).exists())
+        self.assertEqual(self.feed(), [new_post, self.old_post])
+
+    def test_unfollow_prunes_timeline(self):
+        self.client.get(reverse("profile_follow", args=[self.author]))
+        self.client.get(reverse("profile_unfollow", args=[self.author]))
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user).exists())
+        self.assertEqual(self.feed(), [])
+
+    def test_popular_author_is_read_without_fan_out(self):
+        fan = User.objects.create_user(username="fan")
+        Follow.objects.create(user=fan, author=self.author)
+        self.client.get(reverse("profile_follow", args=[self.author]))
+        author_client = Client()
+        author_client.force_login(self.author)
+        new_post = self.publish(author_client, "popular")
+        self.assertFalse(TimelineEntry.objects.filter(post=new_post).exists())
+        self.assertEqual(self.feed(), [new_post, self.old_post])
+
+    def test_author_below_limit_is_fanned_out_again(self):
+        fan = User.objects.create_user(username="fan")
+        Follow.objects.create(user=fan, author=self.author)
+        self.client.get(reverse("profile_follow", args=[self.author]))
+        author_client = Client()
+        author_client.force_login(self.author)
+        popular = self.publish(author_client, "while popular")
+        Follow.objects.filter(user=fan).delete()
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.user, post=popular).exists())
+        self.assertEqual(self.feed(), [popular, self.old_post])
+        # Снова популярный: пост приходит и из ленты, и от автора — один раз
+        Follow.objects.create(user=fan, author=self.author)
+        self.assertEqual(self.feed(), [popular, self.old_post])
+
+    def test_cursor_walk_merges_timeline_and_popular_authors(self):
+        fan = User.objects.create_user(username="fan")
+        star = User.objects.create_user(username="star")
+        Follow.objects.create(user=fan, author=star)
+        self.client.get(reverse("profile_follow", args=[self.author]))
+        self.client.get(reverse("profile_follow", args=[star]))
+        for i in range(12):
+            Post.objects.create(text=f"star {i}", author=star)
+            timeline.fan_out(Post.objects.create(text=f"writer {i}",
+                                                 author=self.author))
+        seen = []
+        response = self.client.get(reverse("follow_index"))
+        while True:
+            page = response.context["page"]
+            seen.extend(page.object_list)
+            if not page.next_cursor:
+                break
+            response = self.client.get(reverse("follow_index"),
+                                       {"cursor": page.next_cursor})
+        expected = list(Post.objects.filter(author__in=[self.author, star])
+                        .order_by("-pub_date", "-id"))
+        self.assertEqual(seen, expected)
+
+
+class ProfileStatsTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create_user(username="writer")
+        self.reader = User.objects.create_user(username="reader")
+        cache.clear()
+
+    def stats(self, user):
+        return self.client.get(
+            reverse("profile", kwargs={"username": user.username})
+        ).context
+
+    def test_counters_follow_posts_and_subscriptions(self):
+        self.stats(self.author)
+        self.stats(self.reader)
+        post = Post.objects.create(text="text", author=self.author)
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        context = self.stats(self.author)
+        self.assertEqual(context["count_post"], 1)
+        self.assertEqual(context["count_following"], 1)
+        self.assertEqual(self.stats(self.reader)["count_follower"], 1)
+        post.delete()
+        follow.delete()
+        context = self.stats(self.author)
+        self.assertEqual(context["count_post"], 0)
+        self.assertEqual(context["count_following"], 0)
+        self.assertEqual(self.stats(self.reader)["count_follower"], 0)
+
+    def test_profile_runs_no_count_queries(self):
+        # Больше страницы: количество постов нужно пагинатору
+        for i in range(12):
+            Post.objects.create(text=f"text {i}", author=self.author)
+        self.stats(self.author)
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            context = self.stats(self.author)
+        self.assertEqual(context["paginator"].count, 12)
+        aggregates = [
+            q["sql"] for q in queries
+            if "COUNT(" in q["sql"].upper()
+            or ('"posts_post"' in q["sql"]
+                and re.search(r"\b(MAX|MIN|SUM|AVG)\(", q["sql"].upper()))
+        ]
+        self.assertEqual(aggregates, [])
+
+    def test_reconcile_fixes_drifted_counters(self):
+        Post.objects.create(text="text", author=self.author)
+        self.stats(self.author)
+        UserStats.objects.filter(user=self.author).update(posts_count=42,
+                                                          followers_count=7)
+        call_command("reconcile_stats", stdout=StringIO())
+        stats = UserStats.objects.get(user=self.author)
+        self.assertEqual((stats.posts_count, stats.followers_count), (1, 0))
+        self.assertTrue(UserStats.objects.filter(user=self.reader).exists())
+
+
+class CommentCountTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="reader")
+        self.client.force_login(self.user)
+        self.post = Post.objects.create(text="text", author=self.user)
+        cache.clear()
+
+    def test_comment_count_follows_comments(self):
+        url = reverse("add_comment", args=[self.user.username, self.post.id])
+        self.client.post(url, {"text": "first"})
+        self.client.post(url, {"text": "second"})
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 2)
+        Comment.objects.first().delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+        response = self.client.get(reverse("index"))
+        self.assertContains(response, "1 комментариев")
+
+
+class PostCardCacheTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create_user(username="writer")
+        self.group = Group.objects.create(title="old group", slug="tt",
+                                          description="test")
+        self.post = Post.objects.create(text="original", author=self.author,
+                                        group=self.group)
+        cache.clear()
+        self.client.get(reverse("index"))
+
+    def test_card_is_rendered_from_cache(self):
+        Post.objects.filter(pk=self.post.pk).update(text="changed silently")
+        response = self.client.get(reverse("index"))
+        self.assertContains(response, "original")
+
+    def test_card_refreshes_after_changes(self):
+        self.post.text = "edited"
+        self.post.save()
+        self.assertContains(self.client.get(reverse("index")), "edited")
+        self.group.title = "new group"
+        self.group.save()
+        self.assertContains(self.client.get(reverse("index")), "#new group")
+        Comment.objects.create(text="hi", author=self.author, post=self.post)
+        self.assertContains(self.client.get(reverse("index")),
+                            "1 комментариев")
+
+    def test_edit_link_only_for_author(self):
+        edit_url = reverse("post_edit", args=[self.author.username,
+                                              self.post.pk])
+        self.assertNotContains(self.client.get(reverse("index")), edit_url)
+        self.client.force_login(self.author)
+        self.assertContains(self.client.get(reverse("index")), edit_url)
+        self.client.logout()
+        self.assertNotContains(self.client.get(reverse("index")), edit_url)
+
+    def test_login_keeps_cards(self):
+        self.author.set_password("secret")
+        self.author.save()
+        objects = [("user", self.author.pk), ("users", "all")]
+        before = cards.generations(*objects)
+        self.assertTrue(self.client.login(username="writer",
+                                          password="secret"))
+        self.assertEqual(cards.generations(*objects), before)
+
+
+class SQLiteCacheTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.location = os.path.join(self.directory.name, "cache.sqlite3")
+
+    def make_cache(self, **options):
+        return SQLiteCache(self.location, {"OPTIONS": options})
+
+    def test_entries_are_shared_between_instances(self):
+        first, second = self.make_cache(), self.make_cache()
+        first.set("key", {"value": 1})
+        self.assertEqual(second.get("key"), {"value": 1})
+        second.delete("key")
+        self.assertIsNone(first.get("key"))
+        self.assertTrue(first.add("counter", 1))
+        self.assertFalse(second.add("counter", 5))
+        self.assertEqual(second.incr("counter"), 2)
+        with self.assertRaises(ValueError):
+            first.incr("missing")
+
+    def test_expired_entry_is_missing(self):
+        cache_backend = self.make_cache()
+        cache_backend.set("key", "value", timeout=0)
+        self.assertIsNone(cache_backend.get("key"))
+        self.assertEqual(cache_backend.get_many(["key"]), {})
+
+    def test_get_or_set_recomputes_once(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return "fresh"
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                self.make_cache().get_or_set("hot", compute, 60)))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ["fresh"] * 4)
+        self.assertEqual(len(calls), 1)
+
+    def test_early_expiration_recomputes_before_deadline(self):
+        cache_backend = self.make_cache(EARLY_EXPIRATION_BETA=1000)
+        cache_backend._write(cache_backend.make_key("key"), "stale", 60,
+                             delta=1)
+        # Джиттер 1000 * ln 2 ≈ 693 с дальше срока в 60 с
+        with mock.patch("yatube.cache.random.random", return_value=0.5):
+            value = cache_backend.get_or_set("key", lambda: "new", 60)
+        self.assertEqual(value, "new")
+
+
+class ThumbnailPregenerationTest(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        self.user = User.objects.create_user(username="writer")
+
+    def test_generate_builds_every_template_geometry(self):
+        with self.settings(MEDIA_ROOT=self.media.name):
+            image = BytesIO()
+            Image.new("RGB", (40, 30), "red").save(image, "png")
+            post = Post.objects.create(
+                text="with image", author=self.user,
+                image=SimpleUploadedFile("small.png", image.getvalue(),
+                                         content_type="image/png"),
+            )
+            thumbnails.generate(post.image.name)
+            built = [name for _, _, files in os.walk(
+                os.path.join(self.media.name, "cache")) for name in files]
+        self.assertEqual(len(built), len(thumbnails.GEOMETRIES))
+
+
+class ImageUploadTest(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        self.client = Client()
+        self.user = User.objects.create_user(username="writer")
+        self.client.force_login(self.user)
+
+    def upload(self, size, **save_options):
+        image = BytesIO()
+        Image.new("RGB", size, "blue").save(image, "jpeg", **save_options)
+        return SimpleUploadedFile("photo.jpeg", image.getvalue(),
+                                  content_type="image/jpeg")
+
+    @override_settings(POST_IMAGE_MAX_SIDE=500)
+    def test_image_is_downsampled_and_stripped(self):
+        exif = Image.Exif()
+        exif[0x010F] = "Camera"
+        with self.settings(MEDIA_ROOT=self.media.name):
+            self.client.post(reverse("new_post"), {
+                "text": "photo",
+                "image": self.upload((2000, 1000), exif=exif.tobytes()),
+            })
+            post = Post.objects.get(text="photo")
+            with Image.open(post.image.path) as stored:
+                self.assertEqual(stored.size, (500, 250))
+                self.assertEqual(stored.format, "JPEG")
+                self.assertNotIn("exif", stored.info)
+
+    @override_settings(POST_IMAGE_MAX_PIXELS=100)
+    def test_huge_image_is_rejected(self):
+        with self.settings(MEDIA_ROOT=self.media.name):
+            response = self.client.post(reverse("new_post"), {
+                "text": "huge",
+                "image": self.upload((20, 20)),
+            })
+        self.assertFalse(Post.objects.filter(text="huge").exists())
+        self.assertTrue(response.context["form"].has_error("image"))
+
+
+class PostsApiTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="reader")
+        token = Token.objects.create(user=self.user)
+        self.client = Client(HTTP_AUTHORIZATION=f"Token {token.key}")
+        self.group = Group.objects.create(title="test", slug="tt",
+                                          description="test")
+        self.posts = [
+            Post.objects.create(text=f"post {i}", author=self.user,
+                                group=self.group)
+            for i in range(5)
+        ]
+
+    def get(self, **params):
+        response = self.client.get(reverse("get_posts"), params)
+        return response.status_code, response.json()
+
+    def test_batch_by_ids_keeps_order_and_fields(self):
+        ids = [self.posts[3].pk, self.posts[0].pk, 999]
+        with CaptureQueriesContext(connection) as queries:
+            status_code, data = self.get(
+                ids=",".join(map(str, ids)),
+                fields="id,text,author_username,group_slug",
+            )
+        self.assertEqual(status_code, 200)
+        self.assertEqual(data["results"], [
+            {"id": self.posts[3].pk, "text": "post 3",
+             "author_username": "reader", "group_slug": "tt"},
+            {"id": self.posts[0].pk, "text": "post 0",
+             "author_username": "reader", "group_slug": "tt"},
+        ])
+        post_queries = [q for q in queries
+                        if "posts_post" in q["sql"]]
+        self.assertEqual(len(post_queries), 1)
+
+    def test_feed_is_cursor_paginated(self):
+        status_code, first = self.get(limit=3, fields="id")
+        self.assertEqual(status_code, 200)
+        status_code, second = self.get(limit=3, fields="id",
+                                       cursor=first["next"])
+        ids = [item["id"] for item in first["results"] + second["results"]]
+        self.assertEqual(ids, [post.pk for post in reversed(self.posts)])
+        self.assertIsNone(second["next"])
+
+    def test_unknown_field_is_rejected(self):
+        status_code, _ = self.get(fields="text,password")
+        self.assertEqual(status_code, 400)
+
+    def test_single_post_supports_conditional_get(self):
+        url = reverse("get_post", args=[self.posts[0].pk])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        again = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(again.status_code, 304)
+        anonymous = Client().get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(anonymous.status_code, 401)
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="writer")
+        self.post = Post.objects.create(text="text", author=self.user)
+        cache.clear()
+
+    def urls(self):
+        return [
+            reverse("index"),
+            reverse("profile", args=[self.user.username]),
+            reverse("post", args=[self.user.username, self.post.pk]),
+        ]
+
+    def test_unchanged_pages_return_not_modified(self):
+        for url in self.urls():
+            response = self.client.get(url)
+            self.assertTrue(response.has_header("ETag"))
+            self.assertTrue(response.has_header("Last-Modified"))
+            again = self.client.get(
+                url, HTTP_IF_NONE_MATCH=response["ETag"]
+            )
+            self.assertEqual(again.status_code, 304, msg=url)
+
+    def test_new_comment_changes_etag(self):
+        url = reverse("post", args=[self.user.username, self.post.pk])
+        etag = self.client.get(url)["ETag"]
+        Comment.objects.create(text="hi", author=self.user, post=self.post)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_differs_per_viewer(self):
+        url = reverse("index")
+        anonymous = self.client.get(url)["ETag"]
+        self.client.force_login(self.user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=anonymous)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("Last-Modified"))
+
+    def test_revalidation_does_not_read_posts(self):
+        for url in self.urls():
+            etag = self.client.get(url)["ETag"]
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304, msg=url)
+            sql = [query["sql"] for query in queries]
+            self.assertFalse([q for q in sql if "COUNT(" in q or "MAX(" in q],
+                             msg=url)
+        etag = self.client.get(reverse("index"))["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("index"),
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def check_changes_etag(self, urls, change):
+        etags = [self.client.get(url)["ETag"] for url in urls]
+        change()
+        for url, etag in zip(urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertNotEqual(response.status_code, 304, msg=url)
+
+    def test_author_group_and_delete_change_etag(self):
+        group = Group.objects.create(title="g", slug="g")
+        self.post.group = group
+        self.post.save()
+        group_url = reverse("group", args=["g"])
+        self.user.first_name = "Автор"
+        self.check_changes_etag(self.urls() + [group_url], self.user.save)
+        group.title = "Группа"
+        self.check_changes_etag(self.urls() + [group_url], group.save)
+        other = Group.objects.create(title="other", slug="other")
+        self.post.group = other
+        self.check_changes_etag([group_url], self.post.save)
+        self.check_changes_etag(self.urls()[:2], self.post.delete)
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="writer")
+        self.cats = Post.objects.create(text="Коты любят спать на солнце",
+                                        author=self.user)
+        self.dogs = Post.objects.create(text="Собаки любят гулять",
+                                        author=self.user)
+        Comment.objects.create(text="А мой кот спит весь день",
+                               author=self.user, post=self.dogs)
+        cache.clear()
+
+    def found(self, query):
+        response = self.client.get(reverse("search"), {"q": query})
+        self.assertEqual(response.status_code, 200)
+        return list(response.context["page"].object_list)
+
+    def check_search(self):
+        self.assertCountEqual(self.found("любят"), [self.cats, self.dogs])
+        self.assertEqual(self.found("коты солнце"), [self.cats])
+        self.assertEqual(self.found("спи*"), [self.dogs])
+        self.assertCountEqual(self.found("кот*"), [self.cats, self.dogs])
+        self.assertEqual(self.found("лошади"), [])
+
+    def test_search_posts_and_comments(self):
+        self.check_search()
+
+    def test_index_follows_deletes(self):
+        self.dogs.comments.all().delete()
+        self.assertEqual(self.found("спи*"), [])
+        self.cats.delete()
+        self.assertEqual(self.found("коты"), [])
+
+    def test_token_index_fallback(self):
+        search._fts_available = False
+        self.addCleanup(setattr, search, "_fts_available", None)
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.check_search()
+
+
+class LoadTestCommandTest(TransactionTestCase):
+    def test_report_per_url_name(self):
+        output = os.path.join(tempfile.mkdtemp(), "report.json")
+        call_command("loadtest", "--existing-db", "--users", "5",
+                     "--posts", "30", "--follows", "10", "--comments", "20",
+                     "--requests", "40", "--concurrency", "2",
+                     "--output", output, stdout=StringIO())
+        with open(output) as source:
+            report = json.load(source)
+        self.assertEqual(report["total_requests"], 40)
+        self.assertIn("index", report["urls"])
+        for row in report["urls"].values():
+            self.assertEqual(list(row["statuses"]), ["200"])
+            self.assertLessEqual(row["p50_ms"], row["p99_ms"])
+            self.assertGreater(row["queries_per_request"], 0)
+        self.assertEqual(
+            Post.objects.filter(comment_count__gt=0).count(),
+            Post.objects.filter(comments__isnull=False).distinct().count(),
+        )
+
+
+class GenerateDataTest(TestCase):
+    def test_skewed_dataset(self):
+        call_command("generate_data", "--users", "100", "--posts", "1000",
+                     "--follows", "1000", "--comments", "2000",
+                     "--batch-size", "300", stdout=StringIO())
+        users = User.objects.filter(username__startswith="synthetic_")
+        self.assertEqual(users.count(), 100)
+        self.assertEqual(Post.objects.count(), 1000)
+        self.assertEqual(Comment.objects.count(), 2000)
+        self.assertGreater(Follow.objects.count(), 500)
+
+        followers = sorted(
+            (stats.followers_count for stats in UserStats.objects.all()),
+            reverse=True,
+        )
+        # Степенной закон: у лидера подписчиков намного больше среднего
+        self.assertGreater(followers[0], 5 * sum(followers) / len(followers))
+        self.assertEqual(sum(followers), Follow.objects.count())
+        self.assertEqual(
+            sum(Post.objects.values_list("comment_count", flat=True)), 2000
+        )
+        dates = Post.objects.values_list("pub_date", flat=True)
+        self.assertGreater(max(dates) - min(dates),
+                           synthetic.BURST_SPAN * 10)
+        self.assertTrue(self.client.login(username="synthetic_0",
+                                          password=synthetic.PASSWORD))
+
+
+@override_settings(REQUEST_METRICS_SAMPLE_RATE=1)
+class MetricsMiddlewareTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="metric")
+        Post.objects.create(text="Замеряемый пост", author=self.user)
+        cache.clear()
+        metrics.registry.reset()
+        self.addCleanup(metrics.uninstall)
+
+    def sampled(self, url):
+        with self.assertLogs("yatube.metrics", "INFO") as logs:
+            self.client.get(url)
+        return json.loads(logs.records[-1].getMessage())
+
+    def test_records_queries_templates_and_cache(self):
+        first = self.sampled(reverse("index"))
+        self.assertEqual(first["view"], "index")
+        self.assertEqual(first["status"], 200)
+        self.assertGreater(first["queries"], 0)
+        self.assertGreater(first["template_ms"], 0)
+        self.assertGreater(first["cache_misses"], 0)
+        second = self.sampled(reverse("index"))
+        self.assertGreater(second["cache_hits"], first["cache_hits"])
+        self.assertLess(second["cache_misses"], first["cache_misses"])
+
+    def test_nested_renders_are_timed_once(self):
+        class Page:
+            def render(self, card=None):
+                time.sleep(0.02)
+                if card is not None:
+                    card.render()
+
+        Page.render = metrics._wrap_render(Page.render)
+        sample = metrics.Sample()
+        token = metrics._current.set(sample)
+        try:
+            Page().render(Page())
+        finally:
+            metrics._current.reset(token)
+        # Внешний рендеринг длится ~0.04 с вместе с вложенным
+        self.assertGreaterEqual(sample.template_time, 0.04)
+        self.assertLess(sample.template_time, 0.06)
+
+    @override_settings(REQUEST_METRICS_SAMPLE_RATE=0)
+    def test_not_sampled(self):
+        with self.assertRaises(AssertionError):
+            self.sampled(reverse("index"))
+        self.assertFalse(metrics.installed())
+
+    def test_uninstall_restores_methods(self):
+        backend = type(caches["default"])
+        render, get = Template.render, backend.get
+        self.sampled(reverse("index"))
+        self.assertTrue(metrics.installed())
+        self.assertIsNot(Template.render, render)
+        metrics.uninstall()
+        self.assertIs(Template.render, render)
+        self.assertIs(backend.get, get)
+
+    def test_metrics_endpoint_for_staff(self):
+        self.sampled(reverse("index"))
+        self.user.is_staff = True
+        self.user.save()
+        with self.settings(REQUEST_METRICS_SAMPLE_RATE=0):
+            response = self.client.get(reverse("metrics"))
+            self.assertEqual(response.status_code, 302)
+            self.client.force_login(self.user)
+            views = self.client.get(reverse("metrics")).json()["views"]
+        self.assertEqual(views["index"]["requests"], 1)
+        self.assertGreater(views["index"]["queries_avg"], 0)
+
+
+@override_settings(QUERY_INSPECTOR_SLOW_MS=10000)
+class QueryInspectorTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="twice")
+        Post.objects.create(text="Пост", author=self.user)
+        self.addCleanup(queries.set_enabled, None)
+
+    def problems(self, url):
+        with self.assertLogs("yatube.queries", "WARNING") as logs:
+            self.client.get(url)
+        return [json.loads(record.getMessage()) for record in logs.records]
+
+    @override_settings(QUERY_INSPECTOR_SLOW_MS=0)
+    def test_switch_at_runtime(self):
+        call_command("query_inspector", "off", stdout=StringIO())
+        with self.assertRaises(AssertionError):
+            self.problems(reverse("profile", args=["twice"]))
+        call_command("query_inspector", "on", stdout=StringIO())
+        problems = self.problems(reverse("profile", args=["twice"]))
+        self.assertTrue(problems)
+        self.assertEqual({problem["view"] for problem in problems},
+                         {"profile"})
+
+    def test_pages_have_no_duplicates(self):
+        group = Group.objects.create(title="g", slug="g")
+        post = Post.objects.create(text="В группе", author=self.user,
+                                   group=group)
+        reader = User.objects.create_user(username="reader")
+        Follow.objects.create(user=reader, author=self.user)
+        Comment.objects.create(text="comment", author=reader, post=post)
+        urls = [reverse("index"), reverse("group", args=["g"]),
+                reverse("profile", args=["twice"]),
+                reverse("post", args=["twice", post.pk])]
+        reader_client = Client()
+        reader_client.force_login(reader)
+        visits = [(Client(), url) for url in urls]
+        visits += [(reader_client, url)
+                   for url in urls + [reverse("follow_index")]]
+        for client, url in visits:
+            # Холодный кэш: счётчики и окна загружаются заново
+            cache.clear()
+            queries.set_enabled(True)
+            with mock.patch.object(queries.logger, "warning") as warning:
+                client.get(url)
+            problems = [json.loads(call.args[0])
+                        for call in warning.call_args_list]
+            self.assertEqual([problem for problem in problems
+                              if problem["kind"] == "duplicate"], [],
+                             msg=url)
+
+    @override_settings(QUERY_INSPECTOR_SLOW_MS=0)
+    def test_origin_falls_back_to_view(self):
+        # Запрос без кода проекта в стеке: render() из асинхронного view
+        site = queries.view_site(views.profile)
+        self.assertRegex(site, r"^posts/views\.py:\d+ in profile$")
+        recorder = queries.Recorder()
+        recorder.queries.append(("SELECT 1", "()", 0.5, None))
+        self.assertEqual(recorder.problems(site)[0]["origin"], site)
+
+    @override_settings(QUERY_INSPECTOR_SLOW_MS=0)
+    def test_slow_queries(self):
+        queries.set_enabled(True)
+        slow = [problem for problem in self.problems(reverse("index"))
+                if problem["kind"] == "slow"]
+        self.assertTrue(slow)
+        self.assertIn("ms", slow[0])
+
+    def test_normalize(self):
+        self.assertEqual(
+            queries.normalize("SELECT * FROM t WHERE id IN (%s, %s, %s) "
+                              "AND  name = 'x' LIMIT 21"),
+            "SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?",
+        )
+
+
+class SQLiteTuningTest(TestCase):
+    def test_pragmas_on_new_connection(self):
+        path = os.path.join(tempfile.mkdtemp(), "tuned.sqlite3")
+        wrapper = DatabaseWrapper(
+            {**connection.settings_dict, "NAME": path,
+             "PRAGMAS": {"cache_size": -1000}},
+            alias="tuned",
+        )
+        self.addCleanup(wrapper.close)
+        with wrapper.cursor() as cursor:
+            for pragma, expected in (("journal_mode", "wal"),
+                                     ("synchronous", 1),
+                                     ("cache_size", -1000),
+                                     ("busy_timeout", 5000)):
+                cursor.execute(f"PRAGMA {pragma}")
+                self.assertEqual(cursor.fetchone()[0], expected)
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command("benchmark_sqlite", "--seconds", "0.2", "--rows", "100",
+                     "--readers", "2", "--writers", "1", stdout=out)
+        self.assertIn("WAL + PRAGMA", out.getvalue())
+
+
+@override_settings(DATABASE_REPLICAS=["replica"], REPLICA_STICKY_SECONDS=30)
+class ReplicaRoutingTest(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.used = []
+
+    def call(self, request, write=False, replica=True):
+        def view(request):
+            self.used.append(router.db_for_read(Post))
+            if write:
+                router.db_for_write(Post)
+            return HttpResponse()
+
+        if replica:
+            view = replicas.read_from_replica(view)
+        return replicas.ReplicaMiddleware(view)(request)
+
+    def test_reads_from_replica(self):
+        self.call(self.factory.get("/"))
+        self.call(self.factory.post("/"))
+        self.call(self.factory.get("/"), replica=False)
+        self.assertEqual(self.used, ["replica", "default", "default"])
+        self.assertEqual(router.db_for_read(Post), "default")
+
+    def test_sticky_after_write(self):
+        response = self.call(self.factory.post("/"), write=True)
+        cookie = response.cookies[replicas.STICKY_COOKIE]
+        self.assertEqual(cookie["max-age"], 30)
+        request = self.factory.get("/")
+        request.COOKIES[replicas.STICKY_COOKIE] = cookie.value
+        self.call(request)
+        request.COOKIES[replicas.STICKY_COOKIE] = str(time.time() - 1)
+        self.call(request)
+        self.assertEqual(self.used, ["default", "default", "replica"])
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas(self):
+        response = self.call(self.factory.get("/"), write=True)
+        self.assertEqual(self.used, ["default"])
+        self.assertNotIn(replicas.STICKY_COOKIE, response.cookies)
+
+
+class LaggingReplicaTestCase(TransactionTestCase):
+    """
+    Реплика «replica» — отдельный файл SQLite с таблицами replica_models,
+    куда попадает только то, что тест скопировал в неё сам (replicate).
+    В TestCase роутер всегда читает из основной базы: идёт транзакция.
+    """
+    replica_models = ()
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        connections.databases["replica"] = {
+            **connections.databases["default"],
+            "NAME": os.path.join(directory.name, "replica.sqlite3"),
+        }
+        self.addCleanup(self.drop_replica)
+        with connections["replica"].schema_editor() as editor:
+            for model in self.replica_models:
+                editor.create_model(model)
+        override = override_settings(DATABASE_REPLICAS=["replica"])
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def drop_replica(self):
+        connections["replica"].close()
+        delattr(connections._connections, "replica")
+        del connections.databases["replica"]
+
+    def replicate(self, *objects):
+        """Копирует строки объектов в реплику — без сигналов модели."""
+        for obj in objects:
+            model = type(obj)
+            rows = model.objects.using("replica").filter(pk=obj.pk)
+            values = {field.attname: getattr(obj, field.attname)
+                      for field in model._meta.concrete_fields
+                      if not field.primary_key}
+            if not rows.update(**values):
+                model.objects.using("replica").bulk_create([obj])
+
+    def read(self, view, request=None):
+        """Ответ view, читающего из реплики, для нового клиента."""
+        request = request or RequestFactory().get("/")
+        return replicas.ReplicaMiddleware(
+            replicas.read_from_replica(view)
+        )(request)
+
+
+class ReplicaLagTest(LaggingReplicaTestCase):
+    replica_models = (User, UserStats)
+
+    def test_stats_missing_on_replica(self):
+        user = User.objects.create_user(username="lagging")
+        Post.objects.create(text="Пост", author=user)
+        self.replicate(user)
+
+        def view(request):
+            return HttpResponse(stats.get_stats(user).posts_count)
+
+        for _ in range(2):
+            response = self.read(view)
+            self.assertEqual(response.content, b"1")
+            self.assertNotIn(replicas.STICKY_COOKIE, response.cookies)
+        self.assertEqual(UserStats.objects.count(), 1)
+        self.assertFalse(UserStats.objects.using("replica").exists())
+
+
+class ReplicaGenerationTest(LaggingReplicaTestCase):
+    replica_models = (User, Group, Post, Follow)
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user(username="editor")
+        self.post = Post.objects.create(text="Старый текст", author=self.user)
+        self.replicate(self.user, self.post)
+        self.post.text = "Новый текст"
+        self.post.save()
+
+    def card(self):
+        def view(request):
+            post = post_cards(Post.objects).get(pk=self.post.pk)
+            return HttpResponse(cards.render_card(post, None))
+        return self.read(view).content.decode()
+
+    def test_card_from_lagging_replica_is_not_cached(self):
+        self.assertIn("Старый текст", self.card())
+        self.replicate(self.post)
+        self.assertIn("Новый текст", self.card())
+
+    def test_no_validators_while_replica_may_lag(self):
+        @conditional.feed_condition(conditional.single_post)
+        def view(request, post_id):
+            return HttpResponse()
+
+        def page(request):
+            return view(request, post_id=self.post.pk)
+
+        self.assertFalse(self.read(page).has_header("ETag"))
+        with self.settings(REPLICA_STICKY_SECONDS=0):
+            self.assertTrue(self.read(page).has_header("ETag"))
+
+    def test_following_reads_primary(self):
+        reader = User.objects.create_user(username="reader")
+        Follow.objects.create(user=reader, author=self.user)
+
+        def view(request):
+            return HttpResponse(str(sorted(follows.following(reader.pk))))
+
+        self.assertEqual(self.read(view).content.decode(),
+                         f"[{self.user.pk}]")
+
+
+@skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN SQLite")
+class FeedIndexTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="indexed")
+        self.group = Group.objects.create(title="g", slug="indexed")
+        self.post = Post.objects.create(text="t", author=self.user,
+                                        group=self.group)
+
+    def assertUsesIndex(self, queryset, index=None):
+        self.assertPlan(queryset.explain(), index)
+
+    def assertPlan(self, plan, index=None):
+        self.assertNotIn("TEMP B-TREE", plan)
+        self.assertIn(index or "USING", plan)
+
+    def test_feed_queries(self):
+        feeds = {
+            None: Post.objects.all(),
+            "post_group_pub_date": self.group.group_posts.all(),
+            "post_author_pub_date": self.user.author_posts.all(),
+        }
+        for index, queryset in feeds.items():
+            paginator = CursorPaginator(post_cards(queryset), 10)
+            for cursor in (None, encode_cursor(self.post)):
+                with self.subTest(index=index, cursor=cursor), \
+                        CaptureQueriesContext(connection) as queries:
+                    paginator.page(cursor)
+                    with connection.cursor() as db:
+                        db.execute("EXPLAIN QUERY PLAN "
+                                   + queries[-1]["sql"])
+                        plan = "\n".join(row[-1] for row in db.fetchall())
+                    self.assertPlan(plan, index)
+
+    def assertPagesUseIndexes(self, paginator, *indexes):
+        """Запросы страниц без сортировки; indexes — каждый хоть где-то."""
+        for cursor in (None, encode_cursor(self.post)):
+            with self.subTest(cursor=cursor), \
+                    CaptureQueriesContext(connection) as queries:
+                paginator.page(cursor)
+            plans = []
+            for query in queries:
+                with connection.cursor() as db:
+                    db.execute("EXPLAIN QUERY PLAN " + query["sql"])
+                    plans.append("\n".join(row[-1]
+                                           for row in db.fetchall()))
+            for plan in plans:
+                self.assertPlan(plan)
+            for index in indexes:
+                self.assertTrue(any(index in plan for plan in plans),
+                                msg=index)
+
+    def test_follow_feed(self):
+        reader = User.objects.create_user(username="reader")
+        star = User.objects.create_user(username="star")
+        Follow.objects.create(user=reader, author=self.user)
+        Follow.objects.create(user=reader, author=star)
+        Post.objects.create(text="s", author=star)
+        paginator = timeline.paginator(reader, 10)
+        self.assertEqual(len(paginator.sources), 2)
+        self.assertPagesUseIndexes(paginator, "post_author_pub_date")
+        # Много подписок — один запрос по индексу pub_date
+        with override_settings(FOLLOW_FEED_MERGE_LIMIT=1):
+            self.assertPagesUseIndexes(timeline.paginator(reader, 10),
+                                       "posts_post_pub_date")
+        with override_settings(FOLLOW_TIMELINE=True,
+                               FOLLOW_TIMELINE_FANOUT_LIMIT=0):
+            timeline.rebuild(reader)
+            paginator = timeline.paginator(reader, 10)
+            self.assertEqual(len(paginator.sources), 3)
+            self.assertPagesUseIndexes(paginator)
+
+    def test_comments_and_follows(self):
+        self.assertUsesIndex(self.post.comments.all()[:10],
+                             "comment_post_created")
+        self.assertUsesIndex(
+            Follow.objects.filter(user=self.user, author=self.user)
+        )
+        self.assertUsesIndex(Follow.objects.filter(author=self.user))
+        self.assertUsesIndex(Follow.objects.filter(user=self.user),
+                             "follow_user_author")
+
+
+class AsyncViewsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="async")
+        self.group = Group.objects.create(title="g", slug="async")
+        self.post = Post.objects.create(text="Асинхронный пост",
+                                        author=self.user, group=self.group)
+        self.token = Token.objects.create(user=self.user)
+        cache.clear()
+
+    def headers(self, **values):
+        # AsyncClient в Django 3.1 принимает заголовки только в scope ASGI
+        return {"headers": [(b"host", b"testserver")] + [
+            (name.replace("_", "-").encode(), value.encode())
+            for name, value in values.items()
+        ]}
+
+    def test_read_views_are_coroutines(self):
+        for view in (views.index, views.group_posts, views.profile,
+                     views.post_view):
+            self.assertTrue(asyncio.iscoroutinefunction(view))
+
+    async def test_served_over_asgi(self):
+        client = AsyncClient()
+        for url in (reverse("index"), reverse("group", args=["async"]),
+                    reverse("profile", args=["async"]),
+                    reverse("post", args=["async", self.post.pk])):
+            response = await client.get(url)
+            self.assertEqual(response.status_code, 200, msg=url)
+            self.assertIn("Асинхронный пост", response.content.decode())
+            again = await client.get(
+                url, **self.headers(if_none_match=response["ETag"])
+            )
+            self.assertEqual(again.status_code, 304, msg=url)
+        missing = await client.get(reverse("profile", args=["nobody"]))
+        self.assertEqual(missing.status_code, 404)
+
+    async def test_api_post_over_asgi(self):
+        client = AsyncClient()
+        url = reverse("get_post", args=[self.post.pk])
+        self.assertEqual((await client.get(url)).status_code, 401)
+        auth = self.headers(authorization=f"Token {self.token.key}")
+        response = await client.get(url, **auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["text"], "Асинхронный пост")
+        response = await client.get(
+            reverse("get_post", args=[self.post.pk + 100]), **auth
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual((await client.post(url, **auth)).status_code, 405)
+
+    def test_gather_is_sequential_inside_transaction(self):
+        threads = async_to_sync(aio.gather)(threading.get_ident,
+                                            threading.get_ident)
+        self.assertEqual(threads, [threading.get_ident()] * 2)
+
+
+class AsyncGatherTest(TransactionTestCase):
+    def test_gather_runs_concurrently(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        def meet():
+            barrier.wait()
+            return Post.objects.count()
+
+        self.assertEqual(async_to_sync(aio.gather)(meet, meet), [0, 0])
+
+
+# Отладочная панель — синхронный middleware, с ней ASGI идёт по очереди
+@override_settings(MIDDLEWARE=[name for name in settings.MIDDLEWARE
+                               if not name.startswith("debug_toolbar")])
+class AsgiConcurrencyTest(TransactionTestCase):
+    def setUp(self):
+        user = User.objects.create_user(username="asgi")
+        group = Group.objects.create(title="g", slug="asgi")
+        Post.objects.create(text="Пост", author=user, group=group)
+        # Только чтения: база тестов в памяти не ждёт блокировок записи
+        stats.get_stats(user)
+
+    async def get(self, application, path):
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"},
+            "http_version": "1.1", "method": "GET", "scheme": "http",
+            "path": path, "raw_path": path.encode(), "query_string": b"",
+            "root_path": "", "headers": [(b"host", b"testserver")],
+            "server": ("testserver", 80), "client": ("127.0.0.1", 1),
+        }
+        sent = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            sent.append(message)
+
+        await application(scope, receive, send)
+        return sent[0]["status"]
+
+    def test_requests_run_concurrently(self):
+        lock = threading.Lock()
+        running = {"now": 0, "most": 0}
+
+        def slow_posts(execute, sql, *args):
+            if not sql.startswith("SELECT") or '"posts_post"' not in sql:
+                return execute(sql, *args)
+            with lock:
+                running["now"] += 1
+                running["most"] = max(running["most"], running["now"])
+            try:
+                time.sleep(0.05)
+                return execute(sql, *args)
+            finally:
+                with lock:
+                    running["now"] -= 1
+
+        application = ASGIHandler()
+
+        async def requests():
+            # Профиль читает базу только через aio.run, без gather
+            url = reverse("profile", args=["asgi"])
+            return await asyncio.gather(*(self.get(application, url)
+                                          for _ in range(6)))
+
+        # Без async_to_sync: как под сервером ASGI, у запросов нет
+        # своего синхронного потока
+        with dbwrappers.execute_wrapper(slow_posts):
+            self.assertEqual(asyncio.run(requests()), [200] * 6)
+        self.assertGreater(running["most"], 1)
+
+
+class CommentPaginationTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="writer")
+        self.post = Post.objects.create(text="text", author=self.user)
+        self.quiet = Post.objects.create(text="quiet", author=self.user)
+        readers = [User.objects.create_user(username=f"reader{i}")
+                   for i in range(5)]
+        for i in range(views.COMMENTS_PER_PAGE + 5):
+            Comment.objects.create(text=f"comment {i}", post=self.post,
+                                   author=readers[i % len(readers)])
+        Comment.objects.create(text="alone", post=self.quiet,
+                               author=self.user)
+        cache.clear()
+
+    def page_queries(self, post):
+        cache.clear()
+        url = reverse("post", args=[self.user.username, post.pk])
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        return response, len(context.captured_queries)
+
+    def test_first_page_costs_the_same(self):
+        response, busy = self.page_queries(self.post)
+        _, quiet = self.page_queries(self.quiet)
+        self.assertEqual(busy, quiet)
+        items = response.context["items"]
+        self.assertEqual(
+            [item.text for item in items],
+            [f"comment {i}" for i in range(24, 4, -1)],
+        )
+        more = response.context["comments"].next_cursor
+        self.assertIn(f"?cursor={more}", response.content.decode())
+        quiet_page = self.page_queries(self.quiet)[0]
+        self.assertIsNone(quiet_page.context["comments"].next_cursor)
+
+    def test_load_more(self):
+        response = self.page_queries(self.post)[0]
+        cursor = response.context["comments"].next_cursor
+        url = reverse("post_comments", args=[self.user.username, self.post.pk])
+        data = self.client.get(url, {"cursor": cursor, "format": "json"}).json()
+        self.assertEqual([item["text"] for item in data["results"]],
+                         [f"comment {i}" for i in range(4, -1, -1)])
+        self.assertEqual(data["results"][0]["author"], "reader4")
+        self.assertIsNone(data["next_cursor"])
+        html = self.client.get(url, {"cursor": cursor}).content.decode()
+        self.assertIn("comment 0", html)
+        self.assertNotIn("comment 5", html)
+
+    def test_bad_requests(self):
+        url = reverse("post_comments", args=[self.user.username, self.post.pk])
+        self.assertEqual(self.client.get(url, {"cursor": "junk"}).status_code,
+                         400)
+        other = reverse("post_comments", args=["reader0", self.post.pk])
+        self.assertEqual(self.client.get(other).status_code, 404)
+
+    def test_missing_post_leaves_no_generations(self):
+        missing = reverse("post_comments", args=["nobody", 10 ** 6])
+        self.assertEqual(self.client.get(missing).status_code, 404)
+        self.assertIsNone(cache.get("card-gen:post:1000000"))
+
+
+class PostViewQueriesTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="writer")
+        self.group = Group.objects.create(title="g", slug="g")
+        self.posts = [
+            Post.objects.create(text=f"post {i}", author=self.user,
+                                group=self.group)
+            for i in range(8)
+        ]
+        Post.objects.create(text="someone else",
+                            author=User.objects.create_user(username="other"))
+        cache.clear()
+
+    def get(self, post):
+        url = reverse("post", args=[self.user.username, post.pk])
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        return response, [query["sql"] for query in context.captured_queries]
+
+    def test_post_comments_and_strip(self):
+        post = self.posts[3]
+        response, sql = self.get(post)
+        self.assertEqual(response.context["page"], [post])
+        self.assertEqual(response.context["profile"], self.user)
+        self.assertEqual(
+            [row["text"] for row in response.context["more_from_author"]],
+            ["post 7", "post 6", "post 5", "post 4", "post 2"],
+        )
+        self.assertIn("post 2", response.content.decode())
+        posts = [query for query in sql if 'FROM "posts_post"' in query]
+        # Пост с автором и группой (и для ETag, и для view), окно автора
+        self.assertEqual(len(posts), 2)
+        _, sql = self.get(self.posts[5])
+        self.assertEqual(
+            len([query for query in sql if 'FROM "posts_post"' in query]), 1
+        )
+
+    def test_strip_follows_new_posts(self):
+        self.get(self.posts[0])
+        Post.objects.create(text="fresh", author=self.user)
+        response, _ = self.get(self.posts[0])
+        self.assertEqual(response.context["more_from_author"][0]["text"],
+                         "fresh")
+
+    @override_settings(AUTHOR_STRIP_SIZE=0)
+    def test_strip_disabled(self):
+        response, _ = self.get(self.posts[0])
+        self.assertEqual(response.context["more_from_author"], [])
+
+
+class WriteBehindCommentTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        write_behind = override_settings(
+            COMMENT_WRITE_BEHIND=True,
+            COMMENT_JOURNAL_DIR=self.directory.name,
+            # Сбрасывает сам тест, фоновый поток не успеет
+            COMMENT_FLUSH_INTERVAL=3600,
+        )
+        write_behind.enable()
+        self.addCleanup(write_behind.disable)
+        self.user = User.objects.create_user(username="writer")
+        self.post = Post.objects.create(text="text", author=self.user)
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.url = reverse("post", args=[self.user.username, self.post.pk])
+        cache.clear()
+
+    def comment(self, text):
+        return self.client.post(
+            reverse("add_comment", args=[self.user.username, self.post.pk]),
+            {"text": text},
+        )
+
+    def test_comment_visible_before_and_after_flush(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.assertRedirects(self.comment("журнальный комментарий"), self.url)
+        self.assertFalse(Comment.objects.exists())
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["pending_comments"]), 1)
+        self.assertContains(response, "журнальный комментарий")
+
+        self.assertEqual(ingest.flush(), 1)
+        comment = Comment.objects.get()
+        self.assertEqual(comment.author, self.user)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+        self.assertEqual(search.search("журнальный"), [self.post.pk])
+        response = self.client.get(self.url)
+        self.assertEqual(response.context["pending_comments"], [])
+        self.assertContains(response, "журнальный комментарий", count=1)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_batch_is_written_once(self):
+        self.comment("раз")
+        self.comment("два")
+        batch = ingest._rotate(ingest._journal_path())
+        copy = batch + ".copy"
+        with open(batch) as source, open(copy, "w") as target:
+            target.write(source.read())
+        self.assertEqual(ingest.flush(), 2)
+        os.rename(copy, batch)
+        self.assertEqual(ingest.flush(), 0)
+        self.assertEqual(Comment.objects.count(), 2)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_orphaned_journal_and_deleted_post(self):
+        finished = subprocess.Popen(["true"])
+        finished.wait()
+        gone = Post.objects.create(text="gone", author=self.user)
+        path = ingest._journal_path(finished.pid)
+        with open(path, "w") as journal:
+            for post in (self.post, gone):
+                journal.write(json.dumps({"key": str(post.pk),
+                                          "post": post.pk,
+                                          "author": self.user.pk,
+                                          "text": "из журнала"}) + "\n")
+            journal.write('{"key": "обрыв')
+        gone.delete()
+        out = StringIO()
+        call_command("flush_comments", stdout=out)
+        self.assertIn("Записано комментариев: 1", out.getvalue())
+        self.assertEqual(Comment.objects.get().post, self.post)
+
+
+@override_settings(FOLLOW_TIMELINE=True)
+class FollowGraphTest(TestCase):
+    def setUp(self):
+        self.reader = User.objects.create_user(username="reader")
+        self.authors = [User.objects.create_user(username=f"author{i}")
+                        for i in range(3)]
+        for author in self.authors:
+            Post.objects.create(text=f"by {author.username}", author=author)
+        token = Token.objects.create(user=self.reader)
+        self.client = Client(HTTP_AUTHORIZATION=f"Token {token.key}")
+        self.url = reverse("follows")
+        cache.clear()
+
+    def post(self, data):
+        return self.client.post(self.url, json.dumps(data),
+                                content_type="application/json")
+
+    def stats(self, user):
+        stats = UserStats.objects.get(user=user)
+        return stats.followers_count, stats.following_count
+
+    def test_bulk_follow_and_unfollow(self):
+        for user in [self.reader, *self.authors]:
+            UserStats.objects.create(user=user)
+        Follow.objects.create(user=self.reader, author=self.authors[0])
+        response = self.post({"follow": ["author0", "author1", "author2",
+                                         "reader", "nobody"]})
+        self.assertEqual(response.json(), {
+            "followed": ["author1", "author2"], "unfollowed": [],
+            "missing": ["nobody"],
+        })
+        self.assertEqual(Follow.objects.filter(user=self.reader).count(), 3)
+        self.assertEqual(self.stats(self.reader), (0, 3))
+        self.assertEqual(self.stats(self.authors[2]), (1, 0))
+        # Подписка на author0 создана в обход views, без раскладки ленты
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.reader).count(), 2
+        )
+        self.assertEqual(self.client.get(self.url).json()["following"],
+                         ["author0", "author1", "author2"])
+
+        response = self.post({"unfollow": ["author1", "author2"],
+                              "follow": []})
+        self.assertEqual(response.json()["unfollowed"],
+                         ["author1", "author2"])
+        self.assertEqual(self.stats(self.reader), (0, 1))
+        self.assertEqual(self.stats(self.authors[1]), (0, 0))
+        self.assertFalse(
+            TimelineEntry.objects.filter(user=self.reader).exists()
+        )
+
+    def test_concurrent_follow_is_counted_once(self):
+        for user in [self.reader, *self.authors]:
+            UserStats.objects.create(user=user)
+        author = self.authors[0]
+        bulk_create = Follow.objects.bulk_create
+
+        def racing(objs, **kwargs):
+            # Одновременный follow_many вставил ту же подписку после
+            # проверки и уже посчитал её
+            bulk_create([Follow(user=self.reader, author=author)])
+            UserStats.objects.filter(user=author).update(followers_count=1)
+            UserStats.objects.filter(user=self.reader).update(
+                following_count=1)
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(Follow.objects, "bulk_create", racing):
+            follows.follow_many(self.reader, [author])
+        self.assertEqual(self.stats(author), (1, 0))
+        self.assertEqual(self.stats(self.reader), (0, 1))
+
+    def test_bad_requests(self):
+        for body in (["author0"], "author0", 1, None):
+            self.assertEqual(self.post(body).status_code, 400, msg=body)
+        self.assertEqual(self.post({"follow": "author0"}).status_code, 400)
+        self.assertEqual(self.post({"follow": ["author0"],
+                                    "unfollow": ["author0"]}).status_code,
+                         400)
+        names = [f"user{i}" for i in range(views.FOLLOW_BATCH_MAX + 1)]
+        self.assertEqual(self.post({"follow": names}).status_code, 400)
+        self.assertEqual(Client().get(self.url).status_code, 401)
+
+    def test_adjacency_cache(self):
+        self.assertFalse(follows.is_following(self.reader, self.authors[0]))
+        follows.follow_many(self.reader, self.authors[:2])
+        follows.following(self.reader.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(follows.following(self.reader.pk),
+                             {self.authors[0].pk, self.authors[1].pk})
+            self.assertTrue(
+                follows.is_following(self.reader, self.authors[1])
+            )
+        Follow.objects.filter(author=self.authors[0]).delete()
+        self.assertEqual(follows.following(self.reader.pk),
+                         {self.authors[1].pk})
+        # Другой процесс сдвинул поколение, словарь этого процесса
+        # ещё помнит старые подписки
+        follows._adjacency[self.reader.pk] = (
+            follows._adjacency[self.reader.pk][0], frozenset()
+        )
+        cache.incr(follows._generation_key(self.reader.pk))
+        self.assertEqual(follows.following(self.reader.pk),
+                         {self.authors[1].pk})
+
+
+class FollowButtonTest(TestCase):
+    def setUp(self):
+        self.reader = User.objects.create_user(username="reader")
+        self.author = User.objects.create_user(username="writer")
+        self.post = Post.objects.create(text="text", author=self.author)
+        self.client = Client()
+        self.client.force_login(self.reader)
+        cache.clear()
+
+    def button(self, url):
+        response = self.client.get(url)
+        content = response.content.decode()
+        self.assertNotEqual("Подписаться" in content,
+                            "Отписаться" in content)
+        return response.context["following"]
+
+    def test_button_follows_state(self):
+        urls = [reverse("profile", args=["writer"]),
+                reverse("post", args=["writer", self.post.pk])]
+        for url in urls:
+            self.assertFalse(self.button(url), msg=url)
+        etags = [self.client.get(url)["ETag"] for url in urls]
+        self.client.get(reverse("profile_follow", args=["writer"]))
+        for url, etag in zip(urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200, msg=url)
+            self.assertTrue(self.button(url), msg=url)
+        self.assertFalse(Client().get(urls[0]).context["following"])
+
+    def test_no_follow_query_when_cached(self):
+        url = reverse("profile", args=["writer"])
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(url)
+        sql = [query["sql"] for query in context.captured_queries]
+        self.assertFalse([query for query in sql if "posts_follow" in query])
+        users = [query for query in sql
+                 if 'FROM "auth_user"' in query and '"username" =' in query]
+        # Профиль загружается один раз — и для ETag, и для view
+        self.assertEqual(len(users), 1)
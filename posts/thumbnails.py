@@ -0,0 +1,71 @@
+"""
+Фоновая генерация миниатюр для картинок постов.
+
+Шаблоны вызывают sorl {% thumbnail %} с геометриями из GEOMETRIES; если
+миниатюры уже построены, тег берёт их из kvstore и не трогает Pillow.
+Поэтому после сохранения поста миниатюры строятся в пуле процессов,
+а manage.py warm_thumbnails прогревает их для уже существующих постов.
+Включается настройкой POST_THUMBNAILS_PREGENERATE.
+"""
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Должны совпадать с {% thumbnail %} в includes/post_item.html
+# и includes/thumbnail.html
+GEOMETRIES = (
+    ('x960', {'crop': 'center', 'upscale': True}),
+    ('960x339', {'crop': 'center', 'upscale': True}),
+)
+
+_executor = None
+
+
+def _init_worker():
+    import django
+    django.setup()
+
+
+def make_executor(workers=None):
+    if workers is None:
+        workers = getattr(settings, 'POST_THUMBNAILS_WORKERS', 2)
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+    )
+
+
+def generate(name):
+    """Строит все миниатюры для файла name из хранилища; возвращает name."""
+    from sorl.thumbnail import get_thumbnail
+    for geometry, options in GEOMETRIES:
+        get_thumbnail(name, geometry, **options)
+    return name
+
+
+def _log_failure(future):
+    error = future.exception()
+    if error is not None:
+        logger.error('Не удалось построить миниатюры: %s', error)
+
+
+def queue(post):
+    """Ставит построение миниатюр поста в очередь после коммита."""
+    if not post.image or not getattr(
+            settings, 'POST_THUMBNAILS_PREGENERATE', False):
+        return
+    name = post.image.name
+
+    def submit():
+        global _executor
+        if _executor is None:
+            _executor = make_executor()
+        _executor.submit(generate, name).add_done_callback(_log_failure)
+
+    transaction.on_commit(submit)
@@ -0,0 +1,165 @@
+"""
+Материализованная лента подписок (fan-out on write).
+
+При публикации поста его id раскладывается по лентам подписчиков автора,
+и /follow/ читает ленту диапазоном по индексу (user, pub_date, post).
+Посты авторов, у которых подписчиков больше FOLLOW_TIMELINE_FANOUT_LIMIT
+(по счётчику UserStats.followers_count), не раскладываются, а
+подмешиваются при чтении (fan-out on read): страница сливается из
+per_page + 1 строк ленты и стольких же строк каждого такого автора.
+Автор, опустившийся до предела, снова раскладывается: его посты
+дописываются в ленты подписчиков (follower_removed).
+Включается настройкой FOLLOW_TIMELINE.
+
+Без материализованной ленты страница так же сливается из per_page + 1
+строк каждого автора из подписок по индексу (author, pub_date, id).
+Читателю с подписками больше FOLLOW_FEED_MERGE_LIMIT лента идёт одним
+запросом по индексу pub_date (feed): авторов так много, что подходящие
+посты встречаются часто.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Sum
+
+from . import follows
+from .feeds import post_cards
+from .models import Follow, Post, TimelineEntry, UserStats
+from .paginators import CursorPaginator, MergedCursorPaginator
+from .stats import get_stats
+
+BATCH_SIZE = 1000
+
+
+def enabled():
+    return getattr(settings, 'FOLLOW_TIMELINE', False)
+
+
+def fanout_limit():
+    return getattr(settings, 'FOLLOW_TIMELINE_FANOUT_LIMIT', 1000)
+
+
+def merge_limit():
+    return getattr(settings, 'FOLLOW_FEED_MERGE_LIMIT', 100)
+
+
+def is_popular(author):
+    return get_stats(author).followers_count > fanout_limit()
+
+
+def popular_authors(user):
+    """Id авторов из подписок пользователя, чьи посты не раскладываются."""
+    return UserStats.objects.filter(
+        user__in=Follow.objects.filter(user=user).values('author'),
+        followers_count__gt=fanout_limit(),
+    ).values_list('user', flat=True)
+
+
+def fan_out(post):
+    """Раскладывает новый пост по лентам подписчиков автора."""
+    if not enabled() or is_popular(post.author_id):
+        return
+    followers = Follow.objects.filter(
+        author=post.author_id
+    ).values_list('user', flat=True)
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+         for user_id in followers.iterator()),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def backfill(user, author):
+    """Добавляет в ленту пользователя посты автора после подписки."""
+    if not enabled() or is_popular(author):
+        return
+    posts = Post.objects.filter(author=author).values_list('pk', 'pub_date')
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=getattr(user, 'pk', user), post_id=pk,
+                       pub_date=pub_date)
+         for pk, pub_date in posts.iterator()),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def follower_removed(author):
+    """
+    Вызывается после отписки от author. Если подписчиков стало ровно
+    FOLLOW_TIMELINE_FANOUT_LIMIT, автор перестал быть популярным, и его
+    посты, опубликованные без раскладки, дописываются в ленты
+    подписчиков — иначе они пропали бы из /follow/.
+    """
+    if not enabled() or get_stats(author).followers_count != fanout_limit():
+        return
+    followers = Follow.objects.filter(author=author).values_list(
+        'user', flat=True)
+    for user_id in followers.iterator():
+        backfill(user_id, author)
+
+
+def prune(user, author):
+    """Убирает посты автора из ленты пользователя после отписки."""
+    if not enabled():
+        return
+    TimelineEntry.objects.filter(user=user, post__author=author).delete()
+
+
+def feed(user):
+    """
+    Queryset постов ленты подписок одним запросом — для читателей с
+    большим числом подписок. Посты идут по индексу pub_date с фильтром по
+    авторам: «+ 0» не даёт SQLite взять индекс автора, после которого все
+    посты подписок пришлось бы сортировать (TEMP B-TREE).
+    """
+    return Post.objects.annotate(author_key=F('author_id') + 0).filter(
+        author_key__in=Follow.objects.filter(user=user).values('author')
+    )
+
+
+def count(user):
+    """Приблизительное количество постов в материализованной ленте."""
+    def load():
+        entries = TimelineEntry.objects.filter(user=user).count()
+        popular = UserStats.objects.filter(
+            user__in=popular_authors(user)
+        ).aggregate(total=Sum('posts_count'))['total']
+        return entries + (popular or 0)
+    timeout = getattr(settings, 'FEED_COUNT_CACHE_TIMEOUT', 60)
+    return cache.get_or_set(f'timeline-count:{user.pk}', load, timeout)
+
+
+def _followed_count(user, authors):
+    """Приблизительное количество постов авторов из подписок."""
+    def load():
+        return Post.objects.filter(author__in=authors).count()
+    timeout = getattr(settings, 'FEED_COUNT_CACHE_TIMEOUT', 60)
+    key = f'follow-count:{user.pk}:{follows.version(user)}'
+    return cache.get_or_set(key, load, timeout)
+
+
+def paginator(user, per_page):
+    """CursorPaginator ленты подписок пользователя."""
+    if not enabled():
+        authors = sorted(follows.following(user.pk))
+        if len(authors) > merge_limit():
+            return CursorPaginator(post_cards(feed(user)), per_page)
+        sources = [(Post.objects.filter(author=author_id), 'id')
+                   for author_id in authors]
+        return MergedCursorPaginator(
+            post_cards(Post.objects.all()), sources, per_page,
+            count=lambda: _followed_count(user, authors),
+        )
+    sources = [(TimelineEntry.objects.filter(user=user), 'post_id')]
+    sources += [(Post.objects.filter(author=author_id), 'id')
+                for author_id in popular_authors(user)]
+    return MergedCursorPaginator(post_cards(Post.objects.all()), sources,
+                                 per_page, count=lambda: count(user))
+
+
+def rebuild(user):
+    """Пересобирает ленту пользователя по текущим подпискам."""
+    TimelineEntry.objects.filter(user=user).delete()
+    for author_id in Follow.objects.filter(user=user).values_list(
+            'author', flat=True):
+        backfill(user, author_id)
@@ -7,6 +7,7 @@ urlpatterns = [
     path("new/", views.new_post, name="new_post"),
     path("follow/", views.follow_index, name="follow_index"),
     path("group/<slug:slug>", views.group_posts, name="group"),
+    path("search/", views.search_posts, name="search"),
     # Профайл пользователя
     path('<str:username>/', views.profile, name='profile'),
     # Просмотр записи
@@ -21,5 +22,12 @@ urlpatterns = [
     path("<str:username>/follow/", views.profile_follow, name="profile_follow"),
     path("<str:username>/unfollow/", views.profile_unfollow, name="profile_unfollow"),
     path("<username>/<int:post_id>/comment", views.add_comment, name="add_comment"),
+    path(
+        "<str:username>/<int:post_id>/comments/",
+        views.post_comments,
+        name="post_comments"
+    ),
+    path("api/v1/posts/", views.get_posts, name="get_posts"),
     path("api/v1/posts/<int:post_id>/", views.get_post, name="get_post"),
+    path("api/v1/follows/", views.follows_api, name="follows"),
 ]
@@ -1,15 +1,24 @@
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
 from django.core.paginator import Paginator
 from django.shortcuts import render, get_object_or_404, redirect
 from django.urls import reverse
 from django.views.decorators.cache import cache_page
 
+from yatube.replicas import read_from_replica
+
+from .feeds import author_strip, post_cards
 from .forms import PostForm, CommentForm    
-from .models import Post, Group, Comment, Follow
+from .models import Post, Comment
+from .paginators import (CursorPaginator, InvalidCursor, apaginate,
+                         comment_page, paginate_with)
+from . import (aio, conditional, follows, ingest, search, thumbnails,
+               timeline)
 
 from django.http import JsonResponse
-from .serializers import PostSerializer
+from .serializers import (PostSerializer, parse_fields, post_values,
+                          serialize_post_rows)
 
 from rest_framework import status
 from rest_framework.decorators import api_view
@@ -18,32 +27,50 @@ from rest_framework.response import Response
 User = get_user_model()
 
 
+COMMENTS_PER_PAGE = 20
+
 #@cache_page(60 * 15)
-def index(request):
-    post_list = Post.objects.order_by('-pub_date').all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+@read_from_replica
+@conditional.feed_condition(conditional.all_posts)
+async def index(request):
+    post_list = post_cards(Post.objects.all())
+    paginator, page = await apaginate(request, post_list, 10)
     context ={
         'page': page,
         'paginator': paginator,
     }
-    return render(request, 'index.html', context, content_type='text/html', status=200)
+    return await aio.run(render, request, 'index.html', context,
+                         content_type='text/html', status=200)
 
 
-def group_posts(request, slug):
-    group = get_object_or_404(Group, slug=slug)
-    posts = group.group_posts.all()
-    paginator = Paginator(posts, 12)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+@read_from_replica
+@conditional.feed_condition(conditional.group_posts)
+async def group_posts(request, slug):
+    group = await aio.run(conditional.page_group, request, slug)
+    posts = post_cards(group.group_posts.all())
+    paginator, page = await apaginate(request, posts, 12)
     context ={
         'page': page,
         'paginator': paginator,
         'group': group,
-        'posts': posts,
     }
-    return render(request, 'group.html', context)
+    return await aio.run(render, request, 'group.html', context)
+
+
+@read_from_replica
+def search_posts(request):
+    query = request.GET.get('q', '').strip()
+    post_ids = search.search(query) if query else []
+    paginator = Paginator(post_ids, 10)
+    page = paginator.get_page(request.GET.get('page'))
+    posts = post_cards(Post.objects.filter(pk__in=page.object_list)).in_bulk()
+    page.object_list = [posts[pk] for pk in page.object_list if pk in posts]
+    context = {
+        'page': page,
+        'paginator': paginator,
+        'query': query,
+    }
+    return render(request, 'search.html', context)
 
 
 @login_required
@@ -58,6 +85,8 @@ def new_post(request):
             post = form.save(commit=False)
             post.author = request.user
             post.save()
+            timeline.fan_out(post)
+            thumbnails.queue(post)
             return redirect('index')
     labels = {
         'title': "Добавить запись",
@@ -66,17 +95,21 @@ def new_post(request):
     return render(request, 'new.html', {'form': form, 'labels': labels})
 
 
-def profile(request, username):
-    profile = get_object_or_404(get_user_model(), username=username)
-    post_list = profile.author_posts.all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    count_post = profile.author_posts.all().count()
-    count_follower = profile.follower.all().count()
-    count_following = profile.following.all().count()
+@read_from_replica
+@conditional.feed_condition(conditional.author_posts)
+async def profile(request, username):
+    # Профиль и счётчики уже загружены для ETag
+    profile, stats = await aio.run(conditional.profile_owner, request,
+                                   username)
+    post_list = post_cards(profile.author_posts.all())
+    paginator, page = await apaginate(request, post_list, 10,
+                                      count=stats.posts_count)
+    count_post = stats.posts_count
+    count_follower = stats.following_count
+    count_following = stats.followers_count
     form = CommentForm()
-    following = get_object_or_404(User, username=username)
+    # Из кэша подписок зрителя (posts/follows.py), без запроса к базе
+    following = await aio.run(follows.is_following, request.user, profile)
     context = {
         "profile": profile,
         'page': page,
@@ -87,27 +120,37 @@ def profile(request, username):
         'form': form,
         'following': following,
     }
-    return render(request, 'profile.html', context)
+    return await aio.run(render, request, 'profile.html', context)
 
 
-def post_view(request, username, post_id):
-    profile = get_object_or_404(get_user_model(), username=username)
-    post = get_object_or_404(Post, id=post_id, author__username=username)
-    post_list = Post.objects.order_by('-pub_date').all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    items = Comment.objects.filter(post_id=post_id).all()
+@read_from_replica
+@conditional.feed_condition(conditional.post_page)
+async def post_view(request, username, post_id):
+    # Пост с автором и группой уже загружен для ETag, автор и есть профиль
+    post = await aio.run(conditional.page_post, request, username, post_id)
+    comments, more_from_author = await aio.gather(
+        lambda: comment_page(Comment.objects.filter(post_id=post_id),
+                             COMMENTS_PER_PAGE, total=post.comment_count),
+        lambda: author_strip(post),
+    )
+    pending = await aio.run(ingest.unconfirmed, request, post_id,
+                            comments.object_list)
+    following = await aio.run(follows.is_following, request.user,
+                              post.author)
     form = CommentForm(request.POST or None)
     context = {
-        'profile': profile,
+        'profile': post.author,
         'post': post,
-        'page': page,
-        'paginator': paginator,
-        'items': items,
+        'page': [post],
+        'items': comments.object_list,
+        'comments': comments,
+        'comments_url': reverse('post_comments', args=[username, post_id]),
+        'more_from_author': more_from_author,
+        'pending_comments': pending,
+        'following': following,
         'form': form,
     }
-    return render(request, 'post.html', context)
+    return await aio.run(render, request, 'post.html', context)
 
 
 @login_required
@@ -119,7 +162,9 @@ def post_edit(request, username, post_id):
     form = PostForm(request.POST or None, files=request.FILES or None, instance=post)
     if request.method == 'POST':
         if form.is_valid():
-            form.save()
+            post = form.save()
+            if 'image' in form.changed_data:
+                thumbnails.queue(post)
             return redirect("post", username=request.user.username, post_id=post_id)
     return render(
         request, 'new.html', {'form': form, 'post': post},
@@ -149,6 +194,10 @@ def add_comment(request, username, post_id):
     if request.method == "POST":
         form = CommentForm(request.POST)
         if form.is_valid():
+            if ingest.enabled():
+                # Запись в базу сделает фоновый поток (posts/ingest.py)
+                ingest.submit(request, post, form.cleaned_data['text'])
+                return redirect(url)
             form.instance.author = request.user
             form.instance.post = post
             form.save()
@@ -156,12 +205,46 @@ def add_comment(request, username, post_id):
     return redirect(url)
 
 
+@read_from_replica
+@conditional.feed_condition(conditional.post_comments)
+async def post_comments(request, username, post_id):
+    """
+    Следующая страница комментариев поста по ?cursor= для кнопки
+    «Ещё комментарии»: HTML-фрагмент, с ?format=json — JSON.
+    """
+    cursor = request.GET.get('cursor')
+    await aio.run(conditional.comments_post, request, username, post_id)
+    try:
+        comments = await aio.run(
+            comment_page, Comment.objects.filter(post_id=post_id),
+            COMMENTS_PER_PAGE, cursor,
+        )
+    except InvalidCursor:
+        return JsonResponse({'detail': 'Неверный курсор'},
+                            status=status.HTTP_400_BAD_REQUEST)
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'results': [
+                {'id': item.id, 'author': item.author.username,
+                 'text': item.text, 'created': item.created}
+                for item in comments
+            ],
+            'next_cursor': comments.next_cursor,
+        })
+    context = {
+        'items': comments.object_list,
+        'comments': comments,
+        'comments_url': request.path,
+    }
+    return await aio.run(render, request, 'includes/comment_list.html',
+                         context)
+
+
+@read_from_replica
 @login_required
 def follow_index(request):
-    post_list = Post.objects.filter(author__following__user=request.user)
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    paginator, page = paginate_with(request,
+                                    timeline.paginator(request.user, 10))
     context = {
         'page': page,
         'paginator': paginator,
@@ -171,28 +254,131 @@ def follow_index(request):
 
 @login_required
 def profile_follow(request, username):
-    follower = request.user
-    following = get_object_or_404(User, username=username)
-    follows = Follow.objects.filter(user=follower, author=following)
-    if follows.exists() or follower.username == following.username:
-        return redirect("profile", username=username)
-    Follow.objects.create(user=follower, author=following)
+    author = get_object_or_404(User, username=username)
+    follows.follow_many(request.user, [author])
     return redirect("profile", username=username)
 
 
 @login_required
 def profile_unfollow(request, username):
-    my_user = request.user
-    profile = get_object_or_404(User, username=username)
-    subscription = Follow.objects.filter(user=my_user, author=profile)
-    if subscription.exists():
-        subscription.delete()
+    author = get_object_or_404(User, username=username)
+    follows.unfollow_many(request.user, [author])
     return redirect("profile", username=request.user.username)
 
 
+@read_from_replica
 @api_view(['GET'])
+@conditional.feed_condition(conditional.single_post)
 def get_post(request, post_id):
+    post = conditional.api_post(request, post_id)
+    return JsonResponse(PostSerializer(post).data)
+
+
+API_MAX_BATCH = 100
+
+
+@read_from_replica
+@api_view(['GET'])
+def get_posts(request):
+    """
+    Пачка постов одним запросом: ?ids=1,2,3 — по списку id (в том же
+    порядке), иначе — лента с курсором ?cursor= и размером ?limit=.
+    ?fields=text,pub_date ограничивает набор полей.
+    """
+    try:
+        fields = parse_fields(request.GET.get('fields'))
+    except ValueError as error:
+        return JsonResponse({'detail': f'Неизвестные поля: {error}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+    posts = post_values(Post.objects.all(), fields)
+    ids = request.GET.get('ids')
+    if ids is not None:
+        try:
+            ids = [int(pk) for pk in ids.split(',') if pk]
+        except ValueError:
+            return JsonResponse({'detail': 'ids — список чисел через запятую'},
+                                status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > API_MAX_BATCH:
+            return JsonResponse(
+                {'detail': f'Не больше {API_MAX_BATCH} id за запрос'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        rows = {row['id']: row for row in posts.filter(pk__in=ids)}
+        found = [rows[pk] for pk in ids if pk in rows]
+        return JsonResponse({'results': serialize_post_rows(found, fields)})
+    try:
+        limit = min(int(request.GET.get('limit', 20)), API_MAX_BATCH)
+    except ValueError:
+        limit = 20
+    page = CursorPaginator(posts, max(limit, 1)).get_page(
+        request.GET.get('cursor')
+    )
+    return JsonResponse({
+        'results': serialize_post_rows(page.object_list, fields),
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    })
+
+
+FOLLOW_BATCH_MAX = 100
+
+
+@api_view(['GET', 'POST'])
+def follows_api(request):
+    """
+    Подписки пользователя. GET — имена авторов, на которых он подписан;
+    POST {"follow": [...], "unfollow": [...]} — подписка и отписка пачкой
+    в одной транзакции.
+    """
     if request.method == 'GET':
-        post = get_object_or_404(Post, id=post_id)
-        serializer = PostSerializer(post)
-        return JsonResponse(serializer.data)
+        authors = User.objects.filter(
+            pk__in=follows.following(request.user.pk)
+        ).order_by('username').values_list('username', flat=True)
+        return JsonResponse({'following': list(authors)})
+    if not isinstance(request.data, dict):
+        return JsonResponse(
+            {'detail': 'Ожидается объект с ключами follow и unfollow'},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    names = {}
+    for action in ('follow', 'unfollow'):
+        value = request.data.get(action, [])
+        if (not isinstance(value, list)
+                or not all(isinstance(name, str) for name in value)):
+            return JsonResponse(
+                {'detail': f'{action} — список имён пользователей'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(value) > FOLLOW_BATCH_MAX:
+            return JsonResponse(
+                {'detail': f'Не больше {FOLLOW_BATCH_MAX} имён в {action}'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        names[action] = value
+    if set(names['follow']) & set(names['unfollow']):
+        return JsonResponse(
+            {'detail': 'Одно и то же имя в follow и в unfollow'},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    users = {
+        user.username: user for user in User.objects.filter(
+            username__in=names['follow'] + names['unfollow']
+        ).only('id', 'username')
+    }
+    with transaction.atomic():
+        followed = follows.follow_many(
+            request.user, [users[name] for name in names['follow']
+                           if name in users]
+        )
+        unfollowed = follows.unfollow_many(
+            request.user, [users[name] for name in names['unfollow']
+                           if name in users]
+        )
+    usernames = {user.pk: name for name, user in users.items()}
+    return JsonResponse({
+        'followed': [usernames[pk] for pk in followed],
+        'unfollowed': [usernames[pk] for pk in unfollowed],
+        'missing': sorted(
+            set(names['follow'] + names['unfollow']) - set(users)
+        ),
+    })
@@ -0,0 +1,258 @@
+"""
+Кэш в файле SQLite, общий для всех воркеров на одном хосте.
+
+LocMemCache у каждого процесса свой: прогрев и инвалидация в одном воркере
+не видны остальным. Здесь записи лежат в одном файле (режим WAL, чтения
+не блокируются записью), а get_or_set с вычисляемым значением защищён
+от «набегания»: значение пересчитывается заранее с вероятностью, растущей
+к моменту истечения (probabilistic early expiration), и только одним
+процессом — остальные в это время получают текущее значение или ждут.
+
+Настройки (OPTIONS):
+    EARLY_EXPIRATION_BETA — агрессивность раннего пересчёта, 0 отключает;
+    LOCK_TIMEOUT — сколько секунд держится блокировка пересчёта;
+    MAX_ENTRIES, CULL_FREQUENCY — как у остальных бэкендов Django.
+"""
+import math
+import os
+import pickle
+import random
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+CULL_EVERY = 100
+POLL_INTERVAL = 0.05
+
+
+class SQLiteCache(BaseCache):
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = location
+        options = params.get('OPTIONS', {})
+        self._beta = float(options.get('EARLY_EXPIRATION_BETA', 1.0))
+        self._lock_timeout = float(options.get('LOCK_TIMEOUT', 10))
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self):
+        # Соединение своё у каждого потока и у каждого процесса после fork
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self._path, timeout=30,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+                'expires REAL, delta REAL NOT NULL DEFAULT 0'
+                ') WITHOUT ROWID'
+            )
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)'
+            )
+            self._local.connection = connection
+            self._local.pid = pid
+        return self._local.connection
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _dumps(self, value):
+        return pickle.dumps(value, self.pickle_protocol)
+
+    def _select(self, key):
+        """(value, expires, delta) живой записи или None."""
+        row = self._connection().execute(
+            'SELECT value, expires, delta FROM cache WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (key, time.time()),
+        ).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(row[0]), row[1], row[2]
+
+    def _write(self, key, value, timeout, delta=0):
+        self._connection().execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires, delta) '
+            'VALUES (?, ?, ?, ?)',
+            (key, self._dumps(value), self.get_backend_timeout(timeout),
+             delta),
+        )
+        self._writes += 1
+        if self._writes % CULL_EVERY == 0:
+            self._cull()
+
+    def _cull(self):
+        connection = self._connection()
+        connection.execute('DELETE FROM cache WHERE expires <= ?',
+                           (time.time(),))
+        count = connection.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        if count > self._max_entries:
+            connection.execute(
+                'DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+                'ORDER BY expires IS NULL, expires LIMIT ?)',
+                (count // self._cull_frequency,),
+            )
+
+    def get(self, key, default=None, version=None):
+        row = self._select(self._key(key, version))
+        return default if row is None else row[0]
+
+    def get_many(self, keys, version=None):
+        made = {self._key(key, version): key for key in keys}
+        result = {}
+        names = list(made)
+        for start in range(0, len(names), 500):
+            chunk = names[start:start + 500]
+            rows = self._connection().execute(
+                'SELECT key, value FROM cache WHERE key IN (%s) '
+                'AND (expires IS NULL OR expires > ?)'
+                % ', '.join('?' * len(chunk)),
+                (*chunk, time.time()),
+            )
+            for name, value in rows:
+                result[made[name]] = pickle.loads(value)
+        return result
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._write(self._key(key, version), value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self.get_backend_timeout(timeout)
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN')
+            connection.executemany(
+                'INSERT OR REPLACE INTO cache (key, value, expires, delta) '
+                'VALUES (?, ?, ?, 0)',
+                [(self._key(key, version), self._dumps(value), expires)
+                 for key, value in data.items()],
+            )
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute(
+                'DELETE FROM cache WHERE key = ? AND expires <= ?',
+                (key, time.time()),
+            )
+            cursor = connection.execute(
+                'INSERT OR IGNORE INTO cache (key, value, expires, delta) '
+                'VALUES (?, ?, ?, 0)',
+                (key, self._dumps(value), self.get_backend_timeout(timeout)),
+            )
+        return cursor.rowcount == 1
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        cursor = self._connection().execute(
+            'UPDATE cache SET expires = ? WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), self._key(key, version),
+             time.time()),
+        )
+        return cursor.rowcount == 1
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            row = self._select(key)
+            if row is None:
+                raise ValueError("Key '%s' not found" % key)
+            value = row[0] + delta
+            connection.execute('UPDATE cache SET value = ? WHERE key = ?',
+                               (self._dumps(value), key))
+        return value
+
+    def delete(self, key, version=None):
+        cursor = self._connection().execute(
+            'DELETE FROM cache WHERE key = ?', (self._key(key, version),)
+        )
+        return cursor.rowcount == 1
+
+    def delete_many(self, keys, version=None):
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN')
+            connection.executemany(
+                'DELETE FROM cache WHERE key = ?',
+                [(self._key(key, version),) for key in keys],
+            )
+
+    def has_key(self, key, version=None):
+        return self._select(self._key(key, version)) is not None
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache')
+
+    def _expires_early(self, expires, delta):
+        """XFetch: чем ближе срок и дороже пересчёт, тем вероятнее промах."""
+        if expires is None or not self._beta:
+            return False
+        jitter = -delta * self._beta * math.log(1 - random.random())
+        return time.time() + jitter >= expires
+
+    def _acquire(self, lock_key):
+        connection = self._connection()
+        now = time.time()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute(
+                'DELETE FROM cache WHERE key = ? AND expires <= ?',
+                (lock_key, now),
+            )
+            cursor = connection.execute(
+                'INSERT OR IGNORE INTO cache (key, value, expires, delta) '
+                'VALUES (?, ?, ?, 0)',
+                (lock_key, self._dumps(os.getpid()),
+                 now + self._lock_timeout),
+            )
+        return cursor.rowcount == 1
+
+    def _release(self, lock_key):
+        self._connection().execute('DELETE FROM cache WHERE key = ?',
+                                   (lock_key,))
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+        Для вычисляемого default значение пересчитывает только один
+        процесс, остальные получают текущее значение, а если его нет —
+        ждут результата не дольше LOCK_TIMEOUT.
+        """
+        if not callable(default):
+            return super().get_or_set(key, default, timeout, version)
+        key = self._key(key, version)
+        lock_key = key + ':lock'
+        deadline = time.time() + self._lock_timeout
+        while True:
+            row = self._select(key)
+            if row is not None and not self._expires_early(*row[1:]):
+                return row[0]
+            if self._acquire(lock_key):
+                try:
+                    started = time.time()
+                    value = default()
+                    self._write(key, value, timeout, time.time() - started)
+                finally:
+                    self._release(lock_key)
+                return value
+            if row is not None:
+                return row[0]
+            if time.time() >= deadline:
+                return default()
+            time.sleep(POLL_INTERVAL)
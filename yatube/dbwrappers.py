@@ -0,0 +1,49 @@
+"""
+Обёртки SQL-запросов на время запроса к сайту — во всех его потоках.
+
+connection.execute_wrapper действует на соединение одного потока, а
+запрос к сайту выполняет SQL в разных потоках: под ASGI — в потоках
+asgiref (sync_to_async), у асинхронных views — в пуле posts/aio.py.
+execute_wrapper() отсюда кладёт обёртку в ContextVar, который asgiref
+передаёт во все эти потоки, а каждое соединение при создании получает
+одну постоянную обёртку, вызывающую обёртки текущего контекста.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+_active = ContextVar('execute_wrappers', default=())
+
+
+def _dispatch(execute, sql, params, many, context):
+    # Первая обёртка — внешняя, как у connection.execute_wrappers
+    for wrapper in reversed(_active.get()):
+        execute = partial(wrapper, execute)
+    return execute(sql, params, many, context)
+
+
+def attach(connection, **kwargs):
+    if _dispatch not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _dispatch)
+
+
+connection_created.connect(attach)
+
+
+@contextmanager
+def execute_wrapper(wrapper):
+    """
+    Как connection.execute_wrapper, но для всех соединений, через которые
+    идут запросы этого контекста.
+    """
+    # Соединения этого потока могли открыться раньше, чем модуль загружен
+    for connection in connections.all():
+        attach(connection)
+    token = _active.set(_active.get() + (wrapper,))
+    try:
+        yield
+    finally:
+        _active.reset(token)
@@ -0,0 +1,305 @@
+"""
+Лёгкая инструментовка запросов для продакшена.
+
+MetricsMiddleware для доли запросов (REQUEST_METRICS_SAMPLE_RATE)
+измеряет время ответа, число и суммарное время SQL-запросов, время
+рендеринга шаблонов и попадания/промахи кэша. Каждый замер пишется
+строкой JSON в логгер yatube.metrics и складывается в агрегаты по имени
+view, которые отдаёт /metrics/ (только для staff).
+
+Запросы без выборки стоят одного вызова random(). SQL считается через
+yatube.dbwrappers только на время выбранного запроса, во всех его
+потоках; хуки рендеринга шаблонов и чтения кэша ставятся при первом
+выбранном запросе (при выключенных метриках классы Django не
+трогаются), вне выбранного запроса ничего не делают и снимаются
+uninstall().
+"""
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
+from django.template.backends.django import Template
+from django.utils.module_loading import import_string
+
+from . import dbwrappers
+
+logger = logging.getLogger('yatube.metrics')
+
+_current = ContextVar('request_metrics', default=None)
+# (класс, имя атрибута, прежнее значение из __dict__ класса или _MISSING)
+_patches = []
+_install_lock = threading.Lock()
+_MISSING = object()
+
+
+class Sample:
+    __slots__ = ('queries', 'sql_time', 'template_time', 'cache_hits',
+                 'cache_misses', 'cache_depth', 'template_depth', 'lock')
+
+    def __init__(self):
+        # Запросы страницы могут идти в нескольких потоках (posts/aio.py)
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_depth = 0
+        self.template_depth = 0
+
+    def execute(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            with self.lock:
+                self.sql_time += time.perf_counter() - started
+                self.queries += 1
+
+
+class Registry:
+    """Агрегаты замеров по имени view с момента запуска процесса."""
+
+    FIELDS = ('wall_ms', 'queries', 'sql_ms', 'template_ms',
+              'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def add(self, view, record):
+        with self._lock:
+            row = self._views.setdefault(view, {
+                'requests': 0,
+                'wall_ms_max': 0.0,
+                **{field: 0 for field in self.FIELDS},
+            })
+            row['requests'] += 1
+            row['wall_ms_max'] = max(row['wall_ms_max'], record['wall_ms'])
+            for field in self.FIELDS:
+                row[field] += record[field]
+
+    def snapshot(self):
+        with self._lock:
+            views = {view: dict(row) for view, row in self._views.items()}
+        result = {}
+        for view, row in views.items():
+            count = row['requests']
+            result[view] = {
+                'requests': count,
+                'wall_ms_max': round(row['wall_ms_max'], 2),
+                **{f'{field}_avg': round(row[field] / count, 2)
+                   for field in self.FIELDS},
+            }
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+
+registry = Registry()
+
+
+def _wrap_render(render):
+    """
+    Считается только внешний рендеринг: вложенные render_to_string
+    (карточки {% post_card %}) уже входят в его время.
+    """
+    @wraps(render)
+    def wrapper(self, *args, **kwargs):
+        sample = _current.get()
+        if sample is None or sample.template_depth:
+            return render(self, *args, **kwargs)
+        sample.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            sample.template_time += time.perf_counter() - started
+            sample.template_depth -= 1
+    return wrapper
+
+
+def _wrap_cache_read(method, count):
+    """
+    count(result, args) -> (hits, misses). Вложенные чтения (get_or_set
+    через get) не учитываются повторно.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        sample = _current.get()
+        if sample is None or sample.cache_depth:
+            return method(self, *args, **kwargs)
+        sample.cache_depth += 1
+        try:
+            result = method(self, *args, **kwargs)
+        finally:
+            sample.cache_depth -= 1
+        hits, misses = count(result, args)
+        sample.cache_hits += hits
+        sample.cache_misses += misses
+        return result
+    return wrapper
+
+
+def _wrap_get(get):
+    @wraps(get)
+    def wrapper(self, key, default=None, version=None):
+        sample = _current.get()
+        if sample is None or sample.cache_depth:
+            return get(self, key, default, version)
+        value = get(self, key, _MISSING, version)
+        if value is _MISSING:
+            sample.cache_misses += 1
+            return default
+        sample.cache_hits += 1
+        return value
+    return wrapper
+
+
+def _wrap_get_or_set(get_or_set):
+    @wraps(get_or_set)
+    def wrapper(self, key, default, *args, **kwargs):
+        sample = _current.get()
+        if sample is None or sample.cache_depth or not callable(default):
+            return get_or_set(self, key, default, *args, **kwargs)
+        computed = []
+
+        def compute():
+            computed.append(True)
+            return default()
+
+        sample.cache_depth += 1
+        try:
+            return get_or_set(self, key, compute, *args, **kwargs)
+        finally:
+            sample.cache_depth -= 1
+            if computed:
+                sample.cache_misses += 1
+            else:
+                sample.cache_hits += 1
+    return wrapper
+
+
+def _patch(owner, name, wrap):
+    _patches.append((owner, name, owner.__dict__.get(name, _MISSING)))
+    setattr(owner, name, wrap(getattr(owner, name)))
+
+
+def installed():
+    return bool(_patches)
+
+
+def install():
+    """Ставит хуки рендеринга шаблонов и чтения кэша (один раз)."""
+    with _install_lock:
+        if _patches:
+            return
+        _patch(Template, 'render', _wrap_render)
+        backends = {import_string(config['BACKEND'])
+                    for config in settings.CACHES.values()}
+        for backend in backends:
+            _patch(backend, 'get', _wrap_get)
+            _patch(backend, 'get_many', lambda get_many: _wrap_cache_read(
+                get_many,
+                lambda result, args: (len(result),
+                                      len(args[0]) - len(result)),
+            ))
+            _patch(backend, 'get_or_set', _wrap_get_or_set)
+
+
+def uninstall():
+    """Возвращает классам шаблонов и кэша их исходные методы."""
+    with _install_lock:
+        while _patches:
+            owner, name, original = _patches.pop()
+            if original is _MISSING:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, original)
+
+
+def _sampled():
+    rate = getattr(settings, 'REQUEST_METRICS_SAMPLE_RATE', 0)
+    if not rate or random.random() >= rate:
+        return None
+    if not _patches:
+        install()
+    return Sample()
+
+
+def _record(request, response, sample, wall):
+    match = request.resolver_match
+    view = match.view_name if match else 'unresolved'
+    record = {
+        'view': view,
+        'method': request.method,
+        'status': response.status_code,
+        'wall_ms': round(wall * 1000, 2),
+        'queries': sample.queries,
+        'sql_ms': round(sample.sql_time * 1000, 2),
+        'template_ms': round(sample.template_time * 1000, 2),
+        'cache_hits': sample.cache_hits,
+        'cache_misses': sample.cache_misses,
+    }
+    logger.info(json.dumps(record, sort_keys=True))
+    registry.add(view, record)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Под ASGI middleware не занимает поток на весь запрос
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self._acall(request)
+        sample = _sampled()
+        if sample is None:
+            return self.get_response(request)
+        token = _current.set(sample)
+        started = time.perf_counter()
+        try:
+            with dbwrappers.execute_wrapper(sample.execute):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        _record(request, response, sample, time.perf_counter() - started)
+        return response
+
+    async def _acall(self, request):
+        sample = _sampled()
+        if sample is None:
+            return await self.get_response(request)
+        token = _current.set(sample)
+        started = time.perf_counter()
+        try:
+            with dbwrappers.execute_wrapper(sample.execute):
+                response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        _record(request, response, sample, time.perf_counter() - started)
+        return response
+
+
+@staff_member_required
+def metrics_view(request):
+    """Агрегаты замеров этого процесса по view."""
+    return JsonResponse({
+        'sample_rate': getattr(settings, 'REQUEST_METRICS_SAMPLE_RATE', 0),
+        'views': registry.snapshot(),
+    }, json_dumps_params={'ensure_ascii': False})
@@ -0,0 +1,189 @@
+"""
+Поиск медленных и повторяющихся SQL-запросов.
+
+QueryInspectorMiddleware через yatube.dbwrappers запоминает запросы
+каждого запроса к сайту (во всех его потоках) и сообщает в логгер yatube.queries:
+- slow — запрос дольше QUERY_INSPECTOR_SLOW_MS миллисекунд;
+- duplicate — один и тот же SQL с теми же параметрами выполнен
+  несколько раз за один запрос к сайту.
+В сообщении view, нормализованный SQL и место в коде проекта, откуда
+запрос был сделан. Если в стеке запроса нет кода проекта (например,
+render() или get_object_or_404, вызванные асинхронным view через
+sync_to_async), местом считается сам view.
+
+Работает без DEBUG и включается на ходу: manage.py query_inspector on|off
+пишет флаг в общий кэш, воркеры перечитывают его раз в
+QUERY_INSPECTOR_REFRESH секунд. Без флага в кэше действует настройка
+QUERY_INSPECTOR.
+"""
+import asyncio
+import inspect
+import json
+import logging
+import os
+import re
+import threading
+import time
+import traceback
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from . import dbwrappers
+
+logger = logging.getLogger('yatube.queries')
+
+FLAG_KEY = 'query-inspector:enabled'
+
+_HERE = os.path.abspath(__file__)
+
+_flag = {'value': None, 'checked': 0.0}
+_flag_lock = threading.Lock()
+
+_PLACEHOLDERS_RE = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+_LITERALS_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SPACES_RE = re.compile(r'\s+')
+
+
+def normalize(sql):
+    """SQL без значений: литералы и списки IN (...) заменяются на ?."""
+    sql = _PLACEHOLDERS_RE.sub('(...)', sql)
+    sql = _LITERALS_RE.sub('?', sql)
+    return _SPACES_RE.sub(' ', sql).strip().replace('%s', '?')
+
+
+def set_enabled(value):
+    """
+    Включает или выключает проверку во всех воркерах;
+    None возвращает к настройке QUERY_INSPECTOR.
+    """
+    if value is None:
+        cache.delete(FLAG_KEY)
+    else:
+        cache.set(FLAG_KEY, bool(value), None)
+    _flag['checked'] = 0.0
+
+
+def _fresh():
+    refresh = getattr(settings, 'QUERY_INSPECTOR_REFRESH', 5)
+    return time.monotonic() - _flag['checked'] < refresh
+
+
+def enabled():
+    if not _fresh():
+        with _flag_lock:
+            value = cache.get(FLAG_KEY)
+            if value is None:
+                value = getattr(settings, 'QUERY_INSPECTOR', False)
+            _flag['value'] = value
+            _flag['checked'] = time.monotonic()
+    return _flag['value']
+
+
+def describe(filename, lineno, name):
+    path = os.path.relpath(os.path.abspath(filename), str(settings.BASE_DIR))
+    return f'{path}:{lineno} in {name}'
+
+
+def origin():
+    """
+    Ближайший к запросу кадр стека из кода проекта (не библиотек);
+    None, если такого нет.
+    """
+    base = str(settings.BASE_DIR)
+    for frame in reversed(traceback.extract_stack()):
+        path = os.path.abspath(frame.filename)
+        if (path.startswith(base) and path != _HERE
+                and 'site-packages' not in path):
+            return describe(path, frame.lineno, frame.name)
+    return None
+
+
+def view_site(view):
+    """Место определения функции view (под декораторами)."""
+    code = getattr(inspect.unwrap(view), '__code__', None)
+    if code is None:
+        return 'unknown'
+    return describe(code.co_filename, code.co_firstlineno, code.co_name)
+
+
+class Recorder:
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.queries.append((sql, repr(params), duration, origin()))
+
+    def problems(self, default='unknown'):
+        """default — место для запросов, у которых его не нашлось."""
+        slow_ms = getattr(settings, 'QUERY_INSPECTOR_SLOW_MS', 100)
+        queries = [(sql, params, duration, where or default)
+                   for sql, params, duration, where in self.queries]
+        found = []
+        for sql, _, duration, where in queries:
+            if duration * 1000 >= slow_ms:
+                found.append({'kind': 'slow', 'sql': normalize(sql),
+                              'ms': round(duration * 1000, 2),
+                              'origin': where})
+        repeats = Counter((sql, params) for sql, params, *_ in queries)
+        for (sql, params), count in repeats.items():
+            if count < 2:
+                continue
+            origins = sorted({where for q_sql, q_params, _, where
+                              in queries
+                              if q_sql == sql and q_params == params})
+            found.append({'kind': 'duplicate', 'sql': normalize(sql),
+                          'count': count, 'origin': ', '.join(origins)})
+        return found
+
+
+def report(request, recorder):
+    match = request.resolver_match
+    view = match.view_name if match else 'unresolved'
+    site = view_site(match.func) if match else 'unknown'
+    for problem in recorder.problems(site):
+        logger.warning(json.dumps(
+            {'view': view, 'path': request.path, **problem},
+            ensure_ascii=False, sort_keys=True,
+        ))
+
+
+class QueryInspectorMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Под ASGI middleware не занимает поток на весь запрос
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self._acall(request)
+        if not enabled():
+            return self.get_response(request)
+        recorder = Recorder()
+        with dbwrappers.execute_wrapper(recorder):
+            response = self.get_response(request)
+        report(request, recorder)
+        return response
+
+    async def _acall(self, request):
+        # Флаг из кэша перечитывается не в цикле событий
+        if not (_flag['value'] if _fresh() else
+                await sync_to_async(enabled, thread_sensitive=False)()):
+            return await self.get_response(request)
+        recorder = Recorder()
+        with dbwrappers.execute_wrapper(recorder):
+            response = await self.get_response(request)
+        report(request, recorder)
+        return response
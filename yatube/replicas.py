@@ -0,0 +1,164 @@
+"""
+Чтение из реплик базы данных.
+
+Реплики перечисляются в настройке DATABASE_REPLICAS (алиасы из
+DATABASES). Views, помеченные @read_from_replica, читают из случайной
+реплики; всё остальное — записи, транзакции, другие views, команды —
+идёт в основную базу default.
+
+Read-your-writes: если за время запроса что-то записывалось в базу,
+ReplicaMiddleware ставит cookie, и следующие REPLICA_STICKY_SECONDS
+секунд запросы этого клиента читают из основной базы — пока реплика
+не догонит. Без реплик роутер ничего не меняет.
+
+Остальные клиенты в это время ещё могут читать из реплики старые данные:
+кэш, ключ которого сдвигается при изменении (поколения posts/cards.py),
+не заполняется такими чтениями — lagging().
+
+Локально реплика — второй файл SQLite, который обновляет
+manage.py sync_replicas (отставание реплики — время между запусками).
+"""
+import asyncio
+import random
+import time
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+STICKY_COOKIE = 'db_primary_until'
+
+_state = ContextVar('replica_state', default=None)
+
+
+class State:
+    __slots__ = ('pinned', 'reading', 'wrote')
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.reading = False
+        self.wrote = False
+
+
+def replicas():
+    return list(getattr(settings, 'DATABASE_REPLICAS', []))
+
+
+def reading_replica():
+    """Идут ли чтения в этом контексте в реплику."""
+    state = _state.get()
+    return bool(state is not None and state.reading and not state.pinned
+                and replicas()
+                and not connections[DEFAULT_DB_ALIAS].in_atomic_block)
+
+
+def lagging(changed_ns):
+    """
+    Могла ли реплика, из которой идут чтения, ещё не получить изменение,
+    сделанное в changed_ns (time.time_ns()). Реплика считается
+    догнавшей через REPLICA_STICKY_SECONDS — столько же после записи
+    сам автор изменения читает из основной базы.
+    """
+    if not reading_replica():
+        return False
+    sticky = getattr(settings, 'REPLICA_STICKY_SECONDS', 10)
+    return time.time_ns() - changed_ns < sticky * 10 ** 9
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if not reading_replica():
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas())
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        pool = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема попадает в реплики вместе с данными
+        return db not in replicas()
+
+
+def read_from_replica(view):
+    """GET и HEAD этого view читают из реплики (если клиент не закреплён)."""
+    if asyncio.iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            state = _state.get()
+            if state is None or request.method not in ('GET', 'HEAD'):
+                return await view(request, *args, **kwargs)
+            state.reading = True
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                state.reading = False
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        state = _state.get()
+        if state is None or request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+        state.reading = True
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            state.reading = False
+    return wrapper
+
+
+def pinned(request):
+    try:
+        return float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def _stick(response, state):
+    if state.wrote and replicas():
+        sticky = getattr(settings, 'REPLICA_STICKY_SECONDS', 10)
+        response.set_cookie(STICKY_COOKIE, str(time.time() + sticky),
+                            max_age=sticky, httponly=True, samesite='Lax')
+    return response
+
+
+class ReplicaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Под ASGI middleware не занимает поток на весь запрос
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self._acall(request)
+        state = State(pinned=pinned(request))
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return _stick(response, state)
+
+    async def _acall(self, request):
+        state = State(pinned=pinned(request))
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return _stick(response, state)
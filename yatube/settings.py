@@ -42,6 +42,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'yatube.metrics.MetricsMiddleware',
+    'yatube.queries.QueryInspectorMiddleware',
+    'yatube.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -49,9 +52,13 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
 ]
 
+if DEBUG:
+    # Только синхронный: под ASGI с ним Django выполняет каждый запрос
+    # целиком в одном общем потоке, то есть запросы идут по очереди
+    MIDDLEWARE.append('debug_toolbar.middleware.DebugToolbarMiddleware')
+
 INTERNAL_IPS = [
     '127.0.0.1',
 ]
@@ -78,17 +85,43 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'yatube.wsgi.application'
 
+# Асинхронные views под ASGI выполняют независимые запросы к базе
+# одновременно, каждый в своём потоке
+ASYNC_PARALLEL_QUERIES = True
+
 
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # SQLite с WAL и PRAGMA для конкурентного доступа (yatube/sqlite3)
+        'ENGINE': 'yatube.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Соединение переиспользуется воркером между запросами
+        'CONN_MAX_AGE': 600,
+        'PRAGMAS': {
+            'cache_size': -64000,
+            'mmap_size': 256 * 1024 * 1024,
+            'busy_timeout': 5000,
+        },
     }
 }
 
+# Реплика только для чтения (yatube/replicas.py). Локально это второй
+# файл SQLite, который обновляет manage.py sync_replicas
+REPLICA_DATABASE = os.environ.get('YATUBE_REPLICA_DB')
+if REPLICA_DATABASE:
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': REPLICA_DATABASE,
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['yatube.replicas.ReplicaRouter']
+# Сколько секунд после записи клиент читает из основной базы
+REPLICA_STICKY_SECONDS = 10
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -144,9 +177,16 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
 # Идентификатор текущего сайта
 SITE_ID = 1
 
+# Общий для всех воркеров кэш в файле SQLite (yatube/cache.py)
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'yatube.cache.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+            'EARLY_EXPIRATION_BETA': 1.0,
+            'LOCK_TIMEOUT': 10,
+        },
     }
 }
 
@@ -159,3 +199,70 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.TokenAuthentication',
     ]
 }
+
+# Материализованная лента подписок (posts/timeline.py)
+FOLLOW_TIMELINE = False
+# Посты авторов с большим числом подписчиков подмешиваются при чтении
+FOLLOW_TIMELINE_FANOUT_LIMIT = 1000
+# Без FOLLOW_TIMELINE: до скольких подписок лента сливается по авторам
+FOLLOW_FEED_MERGE_LIMIT = 100
+
+# Подписки последних пользователей в памяти процесса (posts/follows.py)
+FOLLOW_GRAPH_CACHE_SIZE = 10000
+
+# Время жизни карточки поста во фрагментном кэше (posts/cards.py)
+POST_CARD_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Блок «Ещё от автора» на странице поста (posts/feeds.py); 0 — выключен
+AUTHOR_STRIP_SIZE = 5
+AUTHOR_STRIP_CACHE_TIMEOUT = 60 * 10
+
+# Отложенная запись комментариев через журнал на диске (posts/ingest.py)
+COMMENT_WRITE_BEHIND = False
+COMMENT_JOURNAL_DIR = os.path.join(BASE_DIR, 'var', 'comments')
+COMMENT_FLUSH_INTERVAL = 1
+COMMENT_PENDING_SECONDS = 30
+
+# Фоновая генерация миниатюр после загрузки картинки (posts/thumbnails.py)
+POST_THUMBNAILS_PREGENERATE = not DEBUG
+POST_THUMBNAILS_WORKERS = 2
+
+# Ограничения и обработка загружаемых картинок постов (posts/images.py)
+POST_IMAGE_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+POST_IMAGE_MAX_PIXELS = 40000000
+POST_IMAGE_MAX_SIDE = 1920
+
+# Доля запросов, для которых MetricsMiddleware собирает метрики
+# (yatube/metrics.py): 0 — выключено, 1 — все запросы
+REQUEST_METRICS_SAMPLE_RATE = 0 if DEBUG else 0.01
+
+# Поиск медленных и повторяющихся SQL-запросов (yatube/queries.py);
+# на ходу переключается командой manage.py query_inspector on|off|default
+QUERY_INSPECTOR = False
+QUERY_INSPECTOR_SLOW_MS = 100
+# Как часто воркер перечитывает переключатель из кэша, секунд
+QUERY_INSPECTOR_REFRESH = 5
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        # Строки JSON с метриками выбранных запросов
+        'yatube.metrics': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        # Медленные и повторяющиеся SQL-запросы
+        'yatube.queries': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
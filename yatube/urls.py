@@ -7,6 +7,8 @@ from django.contrib.flatpages import views
 
 from rest_framework.authtoken import views as v
 
+from yatube.metrics import metrics_view
+
 handler404 = "posts.views.page_not_found" # noqa
 handler500 = "posts.views.server_error" # noqa
 
@@ -18,6 +20,8 @@ urlpatterns = [
     # регистрация и авторизация
     path('auth/', include('Users.urls')),
     path('auth/', include('django.contrib.auth.urls')),
+    # агрегаты метрик запросов этого процесса
+    path('metrics/', metrics_view, name='metrics'),
 ]
 
 #добавить маршрут для получения токена: